@@ -0,0 +1,78 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+bench_books.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Measures the cost of resolving a user-supplied book reference, before and
+after the book tables were built once at import.
+Run from the benchmarks directory: python bench_books.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "versebot"))
+
+import books
+
+# Book references as users type them
+REFERENCES = ["John", "1 Jn", "Rom", "eph", "Genesis", "Ps", "Song of Songs",
+              "1 Macc", "rev", "Sirach", "thisisntabook"]
+
+NUMBER = 20000
+
+# Number of calls of the baseline, which is about a hundred times slower
+BASELINE_NUMBER = 200
+
+
+def table_literal(mapping):
+    """ Returns compiled code that builds a table from a dict literal, the
+    way get_book and get_book_number used to on every call.
+
+    :param mapping: The table to write as a literal
+    """
+
+    return compile("{%s}" % ", ".join("%r: %r" % item
+                                      for item in mapping.items()),
+                   "<literal>", "eval")
+
+
+BOOK_NAMES_LITERAL = table_literal(books.BOOK_NAMES)
+BOOK_NUMBERS_LITERAL = table_literal(books.BOOK_NUMBERS)
+
+
+def rebuilt_lookups():
+    for name in REFERENCES:
+        book_name = eval(BOOK_NAMES_LITERAL).get(
+            name.lower().replace(" ", ""))
+        if book_name is not None:
+            eval(BOOK_NUMBERS_LITERAL).get(book_name)
+
+
+def separate_lookups():
+    for name in REFERENCES:
+        book_name = books.get_book(name)
+        if book_name is not None:
+            books.get_book_number(book_name)
+
+
+def single_lookup():
+    for name in REFERENCES:
+        books.resolve_book(name)
+
+
+def main():
+    for name, function, number in (
+            ("before: tables rebuilt", rebuilt_lookups, BASELINE_NUMBER),
+            ("get_book + get_book_number", separate_lookups, NUMBER),
+            ("resolve_book", single_lookup, NUMBER)):
+        seconds = min(timeit.repeat(function, number=number, repeat=5))
+        print("%-28s %8.3f usec per reference"
+              % (name, seconds * 1e6 / (number * len(REFERENCES))))
+
+
+if __name__ == "__main__":
+    main()
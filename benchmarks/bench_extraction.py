@@ -0,0 +1,99 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+bench_extraction.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Measures the cost of extracting verses from saved passage pages, and checks
+that the extraction gives the same output as the previous full-page parse.
+Run from the benchmarks directory: python bench_extraction.py
+"""
+
+import os
+import re
+import sys
+import timeit
+from collections import namedtuple
+
+from bs4 import BeautifulSoup
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, "..", "versebot"))
+
+import webparser
+
+# The parts of a verse the extraction looks at
+Passage = namedtuple("Passage", ["chapter", "start_verse"])
+
+# Saved BibleGateway pages and the passage each was requested for
+PAGES = [("bible_gateway_psalm_119_esv.html", Passage(119, 1)),
+         ("bible_gateway_psalm_117_esv.html", Passage(117, 1)),
+         ("bible_gateway_john_3_16_romans_8_28_esv.html", Passage(3, 16))]
+
+NUMBER = 20
+
+
+def legacy_extract(page, verse):
+    """ The previous extraction: the whole page is parsed with html.parser,
+    then every text span is rendered to check for a chapter number. """
+
+    soup = BeautifulSoup(page, "html.parser")
+    verses = list()
+    number = verse.start_verse
+    numbers = re.compile(r"(\d+)")
+    for v in soup.findAll("span", {"class": "text"}):
+        span_number = re.search(r"-(\d+)$", v["class"][-1])
+        if span_number is not None:
+            number = int(span_number.group(1))
+
+        if v.find("span", {"class": "indent-1-breaks"}) is not None:
+            v.find("span", {"class": "indent-1-breaks"}).decompose()
+        if v.parent.name != "h3" and v.parent.name != "h4":
+            if "<span class=\"chapternum\">" in str(v):
+                text = v.get_text().replace(str(verse.chapter), "1") + " "
+            elif v.get_text().replace(" ", "") == "Back":
+                text = ""
+            else:
+                text = v.get_text() + " "
+            text = numbers.sub(r"[**\1**]", text, 1)
+        else:
+            text = "\n\n>**" + v.get_text() + "**  \n"
+
+        text = re.sub(r"\[\w\]", "", text)
+        if verses and verses[-1][0] == number:
+            verses[-1] = (number, verses[-1][1] + text)
+        else:
+            verses.append((number, text))
+
+    title = soup.find("span", {"class": "passage-display-version"})
+    return verses, title.get_text()
+
+
+def extract(page, verse):
+    soup = webparser.parse_bible_gateway_page(page)
+    verses = webparser.parse_bible_gateway_verses(soup, verse)
+    title = soup.find("span", {"class": "passage-display-version"})
+    return verses, title.get_text()
+
+
+def main():
+    print("parser: %s" % webparser.HTML_PARSER)
+    for name, verse in PAGES:
+        with open(os.path.join(BENCHMARKS, "pages", name), "rb") as f:
+            page = f.read()
+
+        if extract(page, verse) != legacy_extract(page, verse):
+            print("%s: output differs from the full-page parse" % name)
+            continue
+
+        print("%s (%d KiB)" % (name, len(page) // 1024))
+        for label, function in (("full page", legacy_extract),
+                                ("passage only", extract)):
+            seconds = min(timeit.repeat(lambda: function(page, verse),
+                                        number=NUMBER, repeat=5))
+            print("  %-14s %8.3f msec per page"
+                  % (label, seconds * 1e3 / NUMBER))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+bench_pipeline.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Measures every stage of turning a Slack message into a response, offline,
+against the recorded pages served by stubserver.py. Results are written to
+benchmarks/results as JSON and can be compared with an earlier run.
+Run from the benchmarks directory:
+    python bench_pipeline.py [--latency SECONDS] [--compare RESULTS]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, "..", "versebot"))
+
+import cache
+import quoteindex
+import regex
+import stats
+import store
+import webparser
+from ratelimit import SendLimiter
+from response import Response
+from stubserver import StubServer
+from verse import Verse
+from versebot import VerseBot
+
+RESULTS_PATH = os.path.join(BENCHMARKS, "results")
+
+# Messages as they arrive from Slack. Every page they need is recorded in
+# stubserver.PASSAGES or stubserver.PAGES.
+MESSAGES = [
+    "<@U0VERSEBOT> [John 3:16]",
+    "<@U0VERSEBOT> [John 3:16] [Romans 8:28]",
+    "<@U0VERSEBOT> can you post [Psalm 117] please",
+    "<@U0VERSEBOT> [Ps 117:2 esv]",
+    "<@U0VERSEBOT> [Psalm 117 (JPS)]",
+    "<@U0VERSEBOT> [Psalm 119]",
+    "<@U0VERSEBOT> \"For God so loved the world\"",
+    "<@U0VERSEBOT> no references in this one, just saying hello",
+]
+
+NUMBER = 2000
+FETCH_ROUNDS = 20
+PIPELINE_ROUNDS = 20
+
+
+class RecordingWebsocket:
+    """ Stands in for the Slack websocket and keeps what is sent. """
+
+    def __init__(self):
+        self.sent = list()
+
+    async def send(self, data):
+        self.sent.append(data)
+
+
+def reset_caches():
+    """ Empties the passage and chapter caches and replaces the passage store
+    with one that never returns a passage and the quote index with an empty
+    one, so every lookup and quote search is fetched. """
+
+    cache.passage_cache.clear()
+    cache.chapter_cache.clear()
+    directory = tempfile.mkdtemp()
+    webparser.passage_store = store.PassageStore(
+        os.path.join(directory, "bench.sqlite"), max_age=0)
+    webparser.quote_index = quoteindex.QuoteIndex(
+        os.path.join(directory, "bench.sqlite"))
+
+
+def build_verses(message):
+    references = regex.find_references(message) or []
+    return [Verse.from_reference(r, "U0USER", "C0CHANNEL")
+            for r in references]
+
+
+def summarize(samples):
+    """ Returns the mean and percentiles (milliseconds) of a list of
+    durations in seconds. """
+
+    samples = sorted(samples)
+
+    def percentile(p):
+        return samples[max(0, int(math.ceil(p / 100 * len(samples))) - 1)]
+
+    return {"count": len(samples),
+            "mean_ms": sum(samples) / len(samples) * 1e3,
+            "p50_ms": percentile(50) * 1e3,
+            "p90_ms": percentile(90) * 1e3,
+            "p99_ms": percentile(99) * 1e3,
+            "max_ms": samples[-1] * 1e3}
+
+
+def per_message(function):
+    seconds = min(timeit.repeat(function, number=NUMBER, repeat=5))
+    return {"mean_us": seconds * 1e6 / (NUMBER * len(MESSAGES))}
+
+
+def bench_find_verses():
+    def run():
+        for message in MESSAGES:
+            regex.find_verses(message)
+    return per_message(run)
+
+
+def bench_verse_construction():
+    references = [regex.find_references(m) or [] for m in MESSAGES]
+
+    def run():
+        for message_references in references:
+            for r in message_references:
+                Verse.from_reference(r, "U0USER", "C0CHANNEL")
+    return per_message(run)
+
+
+def bench_get_web_contents():
+    verses = [v for m in MESSAGES for v in build_verses(m)]
+    samples = list()
+    for i in range(FETCH_ROUNDS):
+        reset_caches()
+        for v in verses:
+            start = time.perf_counter()
+            webparser.get_web_contents(v)
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_construct_message(parser):
+    samples = list()
+    for i in range(FETCH_ROUNDS):
+        reset_caches()
+        for message in MESSAGES:
+            verses = build_verses(message)
+            if not verses:
+                continue
+            start = time.perf_counter()
+            response = Response(message, parser)
+            for v in verses:
+                response.add_verse(v)
+            response.construct_message()
+            samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_send_verses(bot, cold):
+    """ Handles every message concurrently, PIPELINE_ROUNDS times, and
+    returns the latency of each message and the overall throughput. """
+
+    websocket = RecordingWebsocket()
+    bot.set_connection(websocket)
+    samples = list()
+
+    async def handle(i, message):
+        msg = {"user": "U0USER", "channel": "C%d" % i, "text": message}
+        start = time.perf_counter()
+        await bot.send_verses_response(msg)
+        samples.append(time.perf_counter() - start)
+
+    async def run():
+        for i in range(PIPELINE_ROUNDS):
+            if cold:
+                reset_caches()
+            await asyncio.gather(*[handle(i, m)
+                                   for i, m in enumerate(MESSAGES)])
+
+    reset_caches()
+    loop = asyncio.get_event_loop()
+    if not cold:
+        loop.run_until_complete(run())
+        samples = list()
+        websocket.sent = list()
+
+    start = time.perf_counter()
+    loop.run_until_complete(run())
+    elapsed = time.perf_counter() - start
+
+    results = summarize(samples)
+    results["messages_per_second"] = len(samples) / elapsed
+    results["responses"] = len(websocket.sent)
+    return results
+
+
+def compare(results, previous):
+    """ Prints the change of every measurement against an earlier run. """
+
+    print("\nchange against %s" % previous["timestamp"])
+    for stage, values in sorted(results["stages"].items()):
+        for name, value in sorted(values.items()):
+            before = previous["stages"].get(stage, {}).get(name)
+            if not before or name in ("count", "responses"):
+                continue
+            print("  %-28s %-20s %+7.1f%%"
+                  % (stage, name, (value - before) * 100.0 / before))
+
+
+def main():
+    arguments = argparse.ArgumentParser(
+        description="Measures the message-to-response pipeline offline.")
+    arguments.add_argument("--latency", type=float, default=0.0,
+                           help="seconds the stub server waits per request")
+    arguments.add_argument("--output", help="where to save the results")
+    arguments.add_argument("--compare", help="earlier results to compare")
+    options = arguments.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    server = StubServer(latency=options.latency)
+    server.start()
+    webparser.BIBLE_GATEWAY_URL = server.url
+    webparser.BIBLE_HUB_URL = server.url
+    directory = tempfile.mkdtemp()
+    webparser.translation_catalog.path = os.path.join(directory,
+                                                      "translations.json")
+    stats.usage_stats.path = os.path.join(directory, "stats.sqlite")
+
+    bot = VerseBot("xoxb-benchmark")
+    bot.limiter = SendLimiter(1e9, 1e9, 1e9, 1e9)
+
+    stages = [("find_verses", bench_find_verses),
+              ("verse_construction", bench_verse_construction),
+              ("get_web_contents", bench_get_web_contents),
+              ("construct_message", lambda: bench_construct_message(
+                  bot.parser)),
+              ("send_verses_cold", lambda: bench_send_verses(bot, True)),
+              ("send_verses_warm", lambda: bench_send_verses(bot, False))]
+
+    results = {"timestamp": datetime.datetime.now().isoformat(),
+               "python": platform.python_version(),
+               "html_parser": webparser.HTML_PARSER,
+               "latency": options.latency,
+               "stages": dict()}
+    for name, function in stages:
+        results["stages"][name] = function()
+        print("%-20s %s" % (name, ", ".join(
+            "%s %.3f" % (k, v) if isinstance(v, float) else "%s %d" % (k, v)
+            for k, v in sorted(results["stages"][name].items()))))
+
+    output = options.output or os.path.join(
+        RESULTS_PATH, "pipeline-%s.json"
+        % datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print("results saved to %s" % output)
+
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+bench_references.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Measures the cost of turning Slack message text into parsed references.
+Run from the benchmarks directory: python bench_references.py
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "versebot"))
+
+import books
+import regex
+
+# Messages as they arrive from Slack, mentions included
+MESSAGES = [
+    "<@U0VERSEBOT> [John 3:16]",
+    "<@U0VERSEBOT> can you post [Rom 8:28] please",
+    "<@U0VERSEBOT> [John 3:16] [Rom 8:28] [Eph 2:8-9]",
+    "<@U0VERSEBOT> [Psalm 23 (KJV)]",
+    "<@U0VERSEBOT> [1 Cor 13:4-7 NIV] is what we read at the wedding",
+    "<@U0VERSEBOT> [Genesis 1:1-3 esv] and [John 1:1-5 esv]",
+    "hey <@U0VERSEBOT> what does [Matt 5:3-12] say?",
+    "<@U0VERSEBOT> [Isaiah 53:5 NRSV] [Isaiah 53:6 NRSV]",
+    "<@U0VERSEBOT> [Sirach 3:1-5]",
+    "<@U0VERSEBOT> [Phil 4:13] [Josh 1:9] [Jer 29:11] [Prov 3:5-6]",
+    "<@U0VERSEBOT> [Heb 11:1]",
+    "<@U0VERSEBOT> [Ps 119:105 (JPS)]",
+    "<@U0VERSEBOT> [Mark 16:15-16] [Acts 2:38]",
+    "<@U0VERSEBOT> [thisisntabook 3:16]",
+    "<@U0VERSEBOT> no references in this one, just saying hello",
+    "<@U0VERSEBOT> [Rev 21:4] [John 11:35] [1 Jn 4:8] [Gal 5:22-23]",
+]
+
+NUMBER = 2000
+
+
+def legacy_parse(message_body):
+    """ The previous pipeline: an uncompiled findall, then a book lookup and
+    string munging per match. """
+
+    pattern = (r"(?<=\[)(?P<book>[\d\w\s]+)\s(?P<chapter>\d+)\:?(?P<verse>\d+"
+               r"\-?\d*)?\s*\(?(?P<translation>[\w\-\d]+)?\)?(?=\])")
+    parsed = list()
+    for book, chapter, verse, translation in re.findall(pattern,
+                                                        message_body):
+        book_name = books.get_book(book)
+        if book_name is None:
+            continue
+        books.get_book_number(book_name)
+        chapter = int(chapter.replace(" ", ""))
+        if verse != "":
+            verse = verse.replace(" ", "")
+            if "-" in verse:
+                start_verse, end_verse = verse.split("-")
+                if end_verse == "":
+                    end_verse = start_verse
+                start_verse, end_verse = int(start_verse), int(end_verse)
+            else:
+                start_verse = end_verse = int(verse)
+        else:
+            start_verse = end_verse = 0
+        if translation != "":
+            translation = translation.upper().replace(" ", "")
+        parsed.append((book_name, chapter, start_verse, end_verse,
+                       translation))
+    return parsed
+
+
+def legacy():
+    for message in MESSAGES:
+        legacy_parse(message)
+
+
+def scanner_cold():
+    regex.match_reference.cache_clear()
+    for message in MESSAGES:
+        regex.find_references(message)
+
+
+def scanner_warm():
+    for message in MESSAGES:
+        regex.find_references(message)
+
+
+def main():
+    for name, function in (("findall + munging", legacy),
+                           ("find_references (cold)", scanner_cold),
+                           ("find_references (warm)", scanner_warm)):
+        seconds = min(timeit.repeat(function, number=NUMBER, repeat=5))
+        print("%-24s %8.3f usec per message"
+              % (name, seconds * 1e6 / (NUMBER * len(MESSAGES))))
+
+
+if __name__ == "__main__":
+    main()
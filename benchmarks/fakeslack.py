@@ -0,0 +1,362 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+fakeslack.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Local stand-in for the parts of Slack VerseBot talks to: the auth.test and
+rtm.start Web API methods, and an RTM websocket that replays a stream of
+events at a target rate and records how VerseBot answers them. As on
+Slack, every url returned by rtm.start can only be connected to once.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+import requests
+import websockets
+from slacker import Response
+
+from metrics import ThreadingHTTPServer
+
+BOT_USER_ID = "U0VERSEBOT"
+
+# Kinds of events in a replayed stream
+MENTION = "mention"
+NON_MENTION = "non_mention"
+BOT_MESSAGE = "bot_message"
+ERROR = "error"
+DISCONNECT = "disconnect"
+
+# Share of each kind of event in a stream
+DEFAULT_MIX = {MENTION: 0.5, NON_MENTION: 0.4, BOT_MESSAGE: 0.1}
+
+# Texts of the mentions, all answerable from the pages of stubserver.py
+MENTION_TEXTS = [
+    "<@%s> [John 3:16]" % BOT_USER_ID,
+    "<@%s> [John 3:16] [Romans 8:28]" % BOT_USER_ID,
+    "<@%s> can you post [Psalm 117] please" % BOT_USER_ID,
+    "<@%s> [Ps 117:2 esv]" % BOT_USER_ID,
+    "<@%s> [Psalm 117 (JPS)]" % BOT_USER_ID,
+]
+
+NON_MENTION_TEXT = "has anyone read [John 3:16] today?"
+
+
+class WebAPIHandler(BaseHTTPRequestHandler):
+    """ Answers auth.test and rtm.start. Every token is accepted. """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        token = dict(p.split("=", 1) for p in url.query.split("&")
+                     if "=" in p).get("token", "")
+
+        if url.path == "/api/auth.test":
+            body = {"ok": True, "user_id": BOT_USER_ID, "team_id": token,
+                    "user": "versebot", "team": token}
+        elif url.path == "/api/rtm.start":
+            body = {"ok": True, "self": {"id": BOT_USER_ID},
+                    "url": self.server.slack.session_url(token)}
+        else:
+            body = {"ok": False, "error": "unknown_method"}
+
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Stream:
+    """ Events replayed to one workspace, and what came back. Events are
+    due at a fixed rate from the start of the stream, so a slow reader
+    falls behind rather than slowing the stream down. """
+
+    def __init__(self, events, rate):
+        self.events = events
+        self.rate = rate
+        self.position = 0
+        self.started = None
+        self.sent = dict()
+        self.mentions = dict()
+        self.answered = set()
+        self.replies = set()
+        self.duplicates = 0
+        self.latencies = list()
+        self.pings = 0
+        self.sessions = 0
+        self.connections = 0
+        self.refused = 0
+        self.acks = 0
+        self.max_lag = 0.0
+        self.finished = None
+
+    def next_event(self):
+        """ Returns the time the next event is due and the event, or None
+        once the stream is exhausted. """
+
+        if self.position >= len(self.events):
+            return None
+        if self.started is None:
+            self.started = time.monotonic()
+
+        due = self.started + self.position / self.rate
+        event = self.events[self.position]
+        self.position += 1
+        return due, event
+
+
+class FakeSlack:
+    """ Serves the Web API on a ThreadingHTTPServer and the RTM websocket
+    on an event loop of its own, both on background threads. """
+
+    def __init__(self, rate=10.0, events=100, mix=None, seed=0):
+        """ Initializes a FakeSlack. The servers are started by start().
+
+        :param rate: Events per second sent to each workspace
+        :param events: Number of events sent to each workspace
+        :param mix: Dictionary of the share of each kind of event
+        :param seed: Seed for the order of the events
+        """
+
+        self.rate = rate
+        self.events = events
+        self.mix = mix or DEFAULT_MIX
+        self.seed = seed
+        self.streams = dict()
+        self.used_urls = set()
+        self.rtm_url = None
+        self.api_url = None
+        self._http = None
+        self._loop = None
+        self._done = None
+
+    def start(self):
+        """ Starts the Web API and RTM servers. """
+
+        self._http = ThreadingHTTPServer(("127.0.0.1", 0), WebAPIHandler)
+        self._http.slack = self
+        self.api_url = "http://127.0.0.1:%d" % self._http.server_address[1]
+        threading.Thread(target=self._http.serve_forever,
+                         daemon=True).start()
+
+        started = threading.Event()
+        threading.Thread(target=self._run_rtm, args=(started,),
+                         daemon=True).start()
+        started.wait()
+        if self.rtm_url is None:
+            raise RuntimeError("the RTM server failed to start")
+
+    def stop(self):
+        """ Ends every stream and stops both servers. """
+
+        self._loop.call_soon_threadsafe(self._done.set)
+        self._http.shutdown()
+        self._http.server_close()
+
+    def client(self, token):
+        """ Returns a Slack Web API client for a workspace, to pass to
+        VerseBot in place of Slacker.
+
+        :param token: The token of the workspace
+        """
+
+        return WebAPIClient(self.api_url, token)
+
+    def stream(self, token):
+        """ Returns the stream of a workspace, building it on first use.
+
+        :param token: The token of the workspace
+        """
+
+        if token not in self.streams:
+            shuffle = random.Random("%s-%s" % (self.seed, token))
+            kinds = list()
+            for kind, share in sorted(self.mix.items()):
+                kinds.extend([kind] * int(round(share * self.events)))
+            kinds = (kinds + [NON_MENTION] * self.events)[:self.events]
+            shuffle.shuffle(kinds)
+            self.streams[token] = Stream(kinds, self.rate)
+        return self.streams[token]
+
+    def session_url(self, token):
+        """ Returns the RTM url of a new session of a workspace.
+
+        :param token: The token of the workspace
+        """
+
+        stream = self.stream(token)
+        stream.sessions += 1
+        return "%s/%s/%d" % (self.rtm_url, token, stream.sessions)
+
+    def drained(self):
+        """ Returns true once every event of every stream has been sent and
+        every mention has been answered. """
+
+        return all(sum(s.sent.values()) >= len(s.events) and
+                   len(s.latencies) >= len(s.mentions)
+                   for s in self.streams.values())
+
+    def _run_rtm(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serve_rtm(started))
+        finally:
+            started.set()
+
+    async def _serve_rtm(self, started):
+        self._done = asyncio.Event()
+        server = await websockets.serve(self._connection, "127.0.0.1", 0)
+        self.rtm_url = "ws://127.0.0.1:%d" % (
+            server.sockets[0].getsockname()[1])
+        started.set()
+        await self._done.wait()
+        server.close()
+        await server.wait_closed()
+
+    async def _connection(self, websocket, path=None):
+        """ Replays the stream of the workspace named in the path of the
+        connection, until it ends or an error or disconnect is sent. A
+        connection to a url that was already used is closed straight
+        away. """
+
+        if path is None:
+            path = websocket.request.path
+        stream = self.stream(path.strip("/").split("/")[0])
+        if path in self.used_urls:
+            stream.refused += 1
+            await websocket.close(1008, "url already used")
+            return
+        self.used_urls.add(path)
+        stream.connections += 1
+
+        receiver = asyncio.ensure_future(self._receive(websocket, stream))
+        try:
+            while True:
+                entry = stream.next_event()
+                if entry is None:
+                    await self._hold(receiver)
+                    return
+
+                due, kind = entry
+                delay = due - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                if kind == DISCONNECT:
+                    stream.sent[kind] = stream.sent.get(kind, 0) + 1
+                    return
+
+                await websocket.send(json.dumps(self._event(stream, kind)))
+                stream.sent[kind] = stream.sent.get(kind, 0) + 1
+                stream.max_lag = max(stream.max_lag, time.monotonic() - due)
+                stream.finished = time.monotonic()
+                if kind == ERROR:
+                    # VerseBot closes the connection and reconnects
+                    await self._hold(receiver)
+                    return
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            receiver.cancel()
+
+    async def _hold(self, receiver):
+        """ Waits until the connection is closed by VerseBot or the
+        FakeSlack is stopped. """
+
+        done = asyncio.ensure_future(self._done.wait())
+        await asyncio.wait([receiver, done],
+                           return_when=asyncio.FIRST_COMPLETED)
+        done.cancel()
+
+    def _event(self, stream, kind):
+        number = stream.position
+        event = {"type": "message", "user": "U0USER",
+                 "channel": "C%06d" % number, "ts": "%.6f" % time.time()}
+
+        if kind == MENTION:
+            event["text"] = MENTION_TEXTS[number % len(MENTION_TEXTS)]
+            stream.mentions[event["channel"]] = time.monotonic()
+        elif kind == NON_MENTION:
+            event["text"] = NON_MENTION_TEXT
+        elif kind == BOT_MESSAGE:
+            event["subtype"] = "bot_message"
+            event["text"] = MENTION_TEXTS[0]
+        elif kind == ERROR:
+            event = {"type": "error",
+                     "error": {"code": 1, "msg": "replayed error"}}
+        return event
+
+    async def _receive(self, websocket, stream):
+        """ Answers pings and acknowledges replies, timing the first reply
+        to each mention from the mention. A reply received again, with an
+        id already seen, is counted as a duplicate: Slack would post it
+        twice. """
+
+        while True:
+            try:
+                message = json.loads(await websocket.recv())
+            except websockets.ConnectionClosed:
+                return
+            now = time.monotonic()
+
+            if message.get("type") == "ping":
+                stream.pings += 1
+                await websocket.send(json.dumps(
+                    {"type": "pong", "reply_to": message.get("id"),
+                     "time": message.get("time")}))
+            elif message.get("type") == "message":
+                if message.get("id") in stream.replies:
+                    stream.duplicates += 1
+                stream.replies.add(message.get("id"))
+                channel = message.get("channel")
+                mentioned = stream.mentions.get(channel)
+                if mentioned is not None and channel not in stream.answered:
+                    stream.answered.add(channel)
+                    stream.latencies.append(now - mentioned)
+                    stream.finished = now
+                stream.acks += 1
+                await websocket.send(json.dumps(
+                    {"ok": True, "reply_to": message.get("id"),
+                     "ts": "%.6f" % time.time(),
+                     "text": message.get("text")}))
+
+
+class WebAPIClient:
+    """ The two Slacker methods VerseBot calls, sent to a FakeSlack. """
+
+    def __init__(self, url, token):
+        self.auth = WebAPIMethods(url, token, "auth")
+        self.rtm = WebAPIMethods(url, token, "rtm")
+
+
+class WebAPIMethods:
+    def __init__(self, url, token, group):
+        self.url = url
+        self.token = token
+        self.group = group
+
+    def test(self):
+        return self._call("test")
+
+    def start(self):
+        return self._call("start")
+
+    def _call(self, method):
+        r = requests.get("%s/api/%s.%s" % (self.url, self.group, method),
+                         params={"token": self.token})
+        r.raise_for_status()
+        return Response(r.text)
@@ -0,0 +1,177 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+loadgen.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Load test of VerseBot.listen without a real workspace. One VerseBot per
+workspace connects to fakeslack.py, which replays a stream of mentions,
+other messages, bot messages, errors and disconnects at a target rate,
+while passages are served by stubserver.py. Prints and saves the events
+handled per second, reply latency, duplicate replies, pings and
+reconnects.
+Run from the benchmarks directory:
+    python loadgen.py [--workspaces N] [--rate EVENTS] [--events N]
+        [--mix mention=0.5,non_mention=0.4,bot_message=0.1] [--unlimited]
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, "..", "versebot"))
+
+import quoteindex
+import stats
+import store
+import webparser
+from bench_pipeline import RESULTS_PATH, summarize
+from fakeslack import FakeSlack
+from ratelimit import SendLimiter
+from stubserver import StubServer
+from versebot import VerseBot
+
+# Time (seconds) to wait for replies once every event has been sent
+DRAIN_TIME = 30
+
+
+def parse_mix(text):
+    """ Parses a mix such as "mention=0.5,non_mention=0.5".
+
+    :param text: Comma-separated kind=share pairs
+    """
+
+    mix = dict()
+    for pair in text.split(","):
+        kind, share = pair.split("=")
+        mix[kind.strip()] = float(share)
+    return mix
+
+
+def run(slack, workspaces, unlimited, timeout):
+    """ Runs one VerseBot per workspace until every stream is drained or
+    the timeout passes, then stops them. Returns the bots. """
+
+    loop = asyncio.get_event_loop()
+    bots = list()
+    tasks = list()
+    for i in range(workspaces):
+        token = "xoxb-load-%d" % i
+        bot = VerseBot(token, slack.client(token))
+        if unlimited:
+            bot.limiter = SendLimiter(1e9, 1e9, 1e9, 1e9)
+        bots.append(bot)
+        tasks.append(asyncio.ensure_future(bot.connect()))
+
+    async def wait():
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if len(slack.streams) == workspaces and slack.drained():
+                return
+            await asyncio.sleep(0.1)
+
+    loop.run_until_complete(wait())
+    for task in tasks:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    return bots
+
+
+def collect(slack, bots):
+    """ Returns the measurements of a finished run. """
+
+    streams = list(slack.streams.values())
+    sent = dict()
+    for s in streams:
+        for kind, count in s.sent.items():
+            sent[kind] = sent.get(kind, 0) + count
+
+    started = min(s.started for s in streams if s.started is not None)
+    finished = max(s.finished for s in streams if s.finished is not None)
+    latencies = [t for s in streams for t in s.latencies]
+    mentions = sum(len(s.mentions) for s in streams)
+
+    results = {"events_sent": sent,
+               "events_per_second": sum(sent.values()) / (finished - started),
+               "max_lag_ms": max(s.max_lag for s in streams) * 1e3,
+               "mentions": mentions,
+               "replies": len(latencies),
+               "unanswered": mentions - len(latencies),
+               "duplicates": sum(s.duplicates for s in streams),
+               "pings": sum(s.pings for s in streams),
+               "connections": sum(s.connections for s in streams),
+               "refused": sum(s.refused for s in streams),
+               "queues": [bot.work_queue.stats() for bot in bots
+                          if bot.work_queue is not None]}
+    if latencies:
+        results["reply_latency"] = summarize(latencies)
+    return results
+
+
+def main():
+    arguments = argparse.ArgumentParser(
+        description="Load tests VerseBot against a local fake Slack.")
+    arguments.add_argument("--workspaces", type=int, default=1)
+    arguments.add_argument("--rate", type=float, default=20.0,
+                           help="events per second sent to each workspace")
+    arguments.add_argument("--events", type=int, default=200,
+                           help="events sent to each workspace")
+    arguments.add_argument("--mix", type=parse_mix,
+                           help="share of each kind of event")
+    arguments.add_argument("--latency", type=float, default=0.0,
+                           help="seconds the page server waits per request")
+    arguments.add_argument("--unlimited", action="store_true",
+                           help="lift the per-channel and workspace limits")
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--output", help="where to save the results")
+    options = arguments.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    pages = StubServer(latency=options.latency)
+    pages.start()
+    directory = tempfile.mkdtemp()
+    webparser.BIBLE_GATEWAY_URL = pages.url
+    webparser.BIBLE_HUB_URL = pages.url
+    webparser.translation_catalog.path = os.path.join(directory,
+                                                      "translations.json")
+    webparser.passage_store = store.PassageStore(
+        os.path.join(directory, "load.sqlite"))
+    webparser.quote_index = quoteindex.QuoteIndex(
+        os.path.join(directory, "load.sqlite"))
+    stats.usage_stats.path = os.path.join(directory, "load.sqlite")
+
+    slack = FakeSlack(options.rate, options.events, options.mix,
+                      options.seed)
+    slack.start()
+
+    bots = run(slack, options.workspaces, options.unlimited,
+               options.events / options.rate + DRAIN_TIME)
+    slack.stop()
+    pages.stop()
+
+    results = {"timestamp": datetime.datetime.now().isoformat(),
+               "workspaces": options.workspaces, "rate": options.rate,
+               "events": options.events, "mix": slack.mix,
+               "unlimited": options.unlimited, "latency": options.latency}
+    results.update(collect(slack, bots))
+    print(json.dumps(results, indent=1, sort_keys=True))
+
+    output = options.output or os.path.join(
+        RESULTS_PATH, "loadgen-%s.json"
+        % datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print("results saved to %s" % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+stubserver.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Local HTTP server that answers BibleGateway and Bible Hub requests with the
+recorded pages in benchmarks/pages, so the pipeline can be measured and
+tested without the network. Point VerseBot at it by setting
+webparser.BIBLE_GATEWAY_URL and webparser.BIBLE_HUB_URL to its url, or the
+VERSEBOT_BIBLE_GATEWAY_URL and VERSEBOT_BIBLE_HUB_URL environment
+variables to it before starting VerseBot.
+Run from the benchmarks directory: python stubserver.py [port]
+"""
+
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "versebot"))
+
+from metrics import ThreadingHTTPServer
+
+PAGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "pages")
+
+# Recorded pages served for a path, whatever the query
+PAGES = {
+    "/versions/": "bible_gateway_versions.html",
+    "/quicksearch/": "bible_gateway_quicksearch.html",
+    "/jps/psalms/117.htm": "bible_hub_psalm_117_jps.html",
+}
+
+# Recorded BibleGateway passage pages, by search and version
+PASSAGES = {
+    ("Genesis 1:1", "ESV"): "bible_gateway_genesis_1_1_esv.html",
+    ("John 3:16", "ESV"): "bible_gateway_john_3_16_esv.html",
+    ("John 3:16;Romans 8:28", "ESV"):
+        "bible_gateway_john_3_16_romans_8_28_esv.html",
+    ("Romans 8:28", "ESV"): "bible_gateway_romans_8_28_esv.html",
+    ("Psalms 117", "ESV"): "bible_gateway_psalm_117_esv.html",
+    ("Psalms 117:2", "ESV"): "bible_gateway_psalm_117_2_esv.html",
+    ("Psalms 119", "ESV"): "bible_gateway_psalm_119_esv.html",
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Serves the recorded page for a request, after the server's latency.
+    Requests without a recorded page get a 404. """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        name = PAGES.get(url.path)
+        if url.path == "/passage/":
+            query = parse_qs(url.query)
+            name = PASSAGES.get((query.get("search", [""])[0],
+                                 query.get("version", ["ESV"])[0]))
+
+        self.server.stub.record(url.path)
+        if self.server.stub.latency:
+            time.sleep(self.server.stub.latency)
+
+        if name is None:
+            self.send_error(404)
+            return
+
+        body = self.server.stub.page(name)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer:
+    """ Runs a StubHandler server on a background thread. """
+
+    def __init__(self, port=0, latency=0.0):
+        """ Initializes a StubServer. The server is started by start().
+
+        :param port: Port to listen on, or 0 for any free port
+        :param latency: Time (seconds) to wait before answering a request,
+            standing in for the round trip to the real site
+        """
+
+        self.port = port
+        self.latency = latency
+        self.requests = dict()
+        self._pages = dict()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        """ The base url of the running server. """
+
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def start(self):
+        """ Starts answering requests. """
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port),
+                                           StubHandler)
+        self._server.stub = self
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+
+    def stop(self):
+        """ Stops answering requests and closes the listening socket. """
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def page(self, name):
+        """ Returns a recorded page, reading it on first use.
+
+        :param name: File name of the page in benchmarks/pages
+        """
+
+        with self._lock:
+            if name not in self._pages:
+                with open(os.path.join(PAGES_PATH, name), "rb") as f:
+                    self._pages[name] = f.read()
+            return self._pages[name]
+
+    def record(self, path):
+        """ Counts a request for a path. """
+
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+
+def main():
+    server = StubServer(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
+    server.start()
+    print("serving recorded pages on %s" % server.url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+/*
+  VerseBot for Slack
+  By Matt Arnold
+  create_passage_table.sql
+  Copyright (c) 2016 Matt Arnold (MIT License)
+*/
+
+PRAGMA journal_mode = WAL;
+
+CREATE TABLE IF NOT EXISTS passages (
+    id INTEGER PRIMARY KEY,
+    ref_key TEXT NOT NULL,
+    contents TEXT NOT NULL,
+    trans_title TEXT,
+    permalink TEXT,
+    fetched DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS passages_ref_key ON passages (ref_key);
@@ -0,0 +1,39 @@
+/*
+  VerseBot for Slack
+  By Matt Arnold
+  create_verse_index.sql
+  Copyright (c) 2016 Matt Arnold (MIT License)
+*/
+
+PRAGMA journal_mode = WAL;
+
+CREATE TABLE IF NOT EXISTS verses (
+    id INTEGER PRIMARY KEY,
+    translation TEXT NOT NULL,
+    book TEXT NOT NULL,
+    chapter INTEGER NOT NULL,
+    verse INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS verses_reference
+ON verses (translation, book, chapter, verse);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS verse_text USING fts5 (
+    text,
+    content = 'verses',
+    content_rowid = 'id'
+);
+
+CREATE TRIGGER IF NOT EXISTS verses_insert_text
+AFTER INSERT ON verses
+    BEGIN
+        INSERT INTO verse_text (rowid, text) VALUES (NEW.id, NEW.text);
+    END;
+
+CREATE TRIGGER IF NOT EXISTS verses_delete_text
+AFTER DELETE ON verses
+    BEGIN
+        INSERT INTO verse_text (verse_text, rowid, text)
+        VALUES ('delete', OLD.id, OLD.text);
+    END;
@@ -5,18 +5,51 @@ tests.py
 Copyright (c) 2015 Matthieu Grieger (MIT License)
 """
 
-import logging
+import asyncio
+import gc
+import json
 import os
+import sqlite3
+import struct
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS, '..', 'versebot'))
+sys.path.append(os.path.join(TESTS, '..', 'benchmarks'))
 
 import books
-import database
+import cache
+import catalog
+import defaults
+import fakeslack
+import loadgen
+import localtranslation
+import metrics
+import quoteindex
+import ratelimit
 import regex
+import response
+import singleflight
+import stats
+import store
+import stubserver
+import translation
 import verse
+import versebot
+import versification
 import webparser
+import workqueue
 
-sys.path.append(os.path.join('..', 'versebot'))
+# The translation catalog's refresh thread outlives every test, so its
+# snapshot is kept in one directory for the whole run
+SNAPSHOT_DIRECTORY = tempfile.TemporaryDirectory()
+webparser.translation_catalog.path = os.path.join(SNAPSHOT_DIRECTORY.name,
+                                                  "translations.json")
 
 
 class TestBookRetrieval(unittest.TestCase):
@@ -35,22 +68,82 @@ class TestBookRetrieval(unittest.TestCase):
         self.assertTrue(books.get_book_number("Genesis") == 1)
         self.assertTrue(books.get_book_number("Bel and the Dragon") == 82)
         self.assertTrue(books.get_book_number("thisisntabook") is None)
+
+    def test_book_resolution(self):
+        """ Tests resolving a book reference in a single lookup. """
+
+        self.assertTrue(books.resolve_book("1 Jn") ==
+                        ("1 John", 62, "New Testament"))
+        self.assertTrue(books.resolve_book("Sirach").section ==
+                        "Deuterocanon")
+        self.assertTrue(books.resolve_book("thisisntabook") is None)
         
         
-class TestBibleGatewayParsing(unittest.TestCase):
+class StubServerTestCase(unittest.TestCase):
+    """ Base for tests that run VerseBot's fetches and writes. Pages are
+    served from the recorded pages in benchmarks/pages by a StubServer, and
+    the passage store, quote index and usage stats are kept in a temporary
+    directory. Stored passages are never fresh, so anything missing from
+    the emptied passage caches is fetched. The originals are put back after
+    each test. """
+
+    def setUp(self):
+        self.server = stubserver.StubServer()
+        self.server.start()
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "test.sqlite")
+        self.originals = (webparser.BIBLE_GATEWAY_URL,
+                          webparser.BIBLE_HUB_URL, webparser.passage_store,
+                          webparser.quote_index, stats.usage_stats.path)
+        webparser.BIBLE_GATEWAY_URL = webparser.BIBLE_HUB_URL = \
+            self.server.url
+        webparser.passage_store = store.PassageStore(path, max_age=0)
+        webparser.quote_index = quoteindex.QuoteIndex(path)
+        stats.usage_stats.path = path
+        cache.passage_cache.clear()
+        cache.chapter_cache.clear()
+
+    def tearDown(self):
+        webparser.passage_store.flush()
+        webparser.quote_index.flush()
+        stats.usage_stats.flush()
+        (webparser.BIBLE_GATEWAY_URL, webparser.BIBLE_HUB_URL,
+         webparser.passage_store, webparser.quote_index,
+         stats.usage_stats.path) = self.originals
+        cache.passage_cache.clear()
+        cache.chapter_cache.clear()
+        self.server.stop()
+        self.directory.cleanup()
+
+
+class TestBibleGatewayParsing(StubServerTestCase):
     """ Tests parsing of BibleGateway webpages. """
-    
+
     def test_supported_translation_retrieval(self):
         """ Tests retrieval of supported translations. """
 
         parser = webparser.WebParser()
+        self.assertTrue(webparser.translation_catalog.refresh())
         self.assertTrue(len(parser.translations) != 0)
+
+    def test_translation_testaments(self):
+        """ Tests that each translation only covers the testaments of its
+        own row, whatever the rows before it cover. """
+
+        translations = dict((t.abbreviation, t) for t in
+                            webparser.find_supported_translations())
+        coverage = dict((abbreviation, (t.has_ot, t.has_nt, t.has_deut))
+                        for abbreviation, t in translations.items())
+        self.assertTrue(coverage == {
+            "SBLGNT": (False, True, False), "KJV": (True, True, False),
+            "WLC": (True, False, False), "NIV": (True, True, False),
+            "NRSV": (True, True, True), "ESV": (True, True, False),
+            "DRA": (True, True, True), "JPS": (True, False, False)})
         
     def test_bible_gateway_text_retrieval(self):
         """ Tests the retrieval of BibleGateway verse contents. """
 
         parser = webparser
-        database.connect(logging.getLogger("versebot"))
         v = verse.Verse("Genesis", "1", "esv", "mgrieger",
                         "VerseBot", verse="1")
         self.assertTrue("In the beginning, God created "
@@ -58,6 +151,993 @@ class TestBibleGatewayParsing(unittest.TestCase):
                         parser.get_bible_gateway_verse(v)[0])
         
 
+class TestPassageCache(unittest.TestCase):
+    """ Tests the in-memory passage cache. """
+
+    def test_hit_and_miss(self):
+        """ Tests that stored passages are returned and counted. """
+
+        c = cache.PassageCache()
+        self.assertTrue(c.get("John 3:16") is None)
+        c.put("John 3:16", ("For God so loved", "ESV", "link"))
+        self.assertTrue(c.get("John 3:16")[0] == "For God so loved")
+        self.assertTrue(c.hits == 1 and c.misses == 1)
+
+    def test_size_eviction(self):
+        """ Tests that the least recently used passage is evicted once the
+        cache is full. """
+
+        c = cache.PassageCache(max_size=10)
+        c.put("a", ("aaaa",))
+        c.put("b", ("bbbb",))
+        c.get("a")
+        c.put("c", ("cccc",))
+        self.assertTrue(c.get("b") is None)
+        self.assertTrue(c.get("a") is not None)
+        self.assertTrue(c.evictions == 1 and c.size == 8)
+
+    def test_expiry(self):
+        """ Tests that expired passages are not returned. """
+
+        c = cache.PassageCache(ttl=0)
+        c.put("a", ("aaaa",))
+        self.assertTrue(c.get("a") is None)
+        self.assertTrue(c.expirations == 1 and len(c) == 0)
+
+
+class TestPassageStore(unittest.TestCase):
+    """ Tests the on-disk passage store. """
+
+    def test_write_behind_and_read(self):
+        """ Tests that queued passages can be read back once flushed. """
+
+        with tempfile.TemporaryDirectory() as directory:
+            s = store.PassageStore(os.path.join(directory, "test.sqlite"))
+            key = ("John", 3, 16, 16, "ESV")
+            self.assertTrue(s.get(key) is None)
+            s.put(key, ("For God so loved", "ESV", "link"))
+            s.flush()
+            self.assertTrue(s.get(key) ==
+                            ("For God so loved", "ESV", "link"))
+            self.assertTrue(store.ref_key(key) == "ESV|John|3|16|16")
+
+
+class TestPassageExtraction(unittest.TestCase):
+    """ Tests extracting verses from a BibleGateway passage page. """
+
+    page = ("<html><body><nav><span class=\"text\">Menu</span></nav>"
+            "<h1><span class=\"passage-display-version\">English Standard "
+            "Version (ESV)</span></h1><div class=\"passage-text\">"
+            "<h3><span class=\"text Ps-117-1\">Praise</span></h3>"
+            "<p><span class=\"text Ps-117-1\"><span class=\"chapternum\">"
+            "117 </span>Praise the Lord!<sup>[<a>a</a>]</sup></span><br />"
+            "<span class=\"text Ps-117-1\"><span class=\"indent-1\"><span "
+            "class=\"indent-1-breaks\">  </span>Extol him!</span></span>"
+            "<span class=\"text Ps-117-2\"><sup class=\"versenum\">2 </sup>"
+            "For great is his love.</span></p></div></body></html>")
+
+    def test_passage_extraction(self):
+        """ Tests that only the passage is read, and that headings, chapter
+        numbers, indentation and footnotes are handled. """
+
+        v = verse.Verse("Psalms", "117", "esv", "mgrieger", "VerseBot",
+                        verse="")
+        soup = webparser.parse_bible_gateway_page(self.page)
+        self.assertTrue(webparser.parse_bible_gateway_verses(soup, v) == [
+            (1, "\n\n>**Praise**  \n[**1**] Praise the Lord! Extol him! "),
+            (2, "[**2**] For great is his love. ")])
+        self.assertTrue(soup.find(
+            "span", {"class": "passage-display-version"}).get_text() ==
+            "English Standard Version (ESV)")
+
+
+class TestResponsePlanning(StubServerTestCase):
+    """ Tests how responses are planned, fetched and sent. """
+
+    def setUp(self):
+        StubServerTestCase.setUp(self)
+        self.lengths = (response.MINIMUM_VERSE_LENGTH,
+                        response.MAXIMUM_RESPONSE_LENGTH)
+
+    def tearDown(self):
+        (response.MINIMUM_VERSE_LENGTH,
+         response.MAXIMUM_RESPONSE_LENGTH) = self.lengths
+        StubServerTestCase.tearDown(self)
+
+    def build_response(self, *verses):
+        r = response.Response("", webparser)
+        for book, chapter, v in verses:
+            r.add_verse(verse.Verse(book, chapter, "esv", "mgrieger",
+                                    "VerseBot", verse=v))
+        return r
+
+    def test_certain_overflow(self):
+        """ Tests that a response too long at the shortest verse lengths
+        is answered with links without fetching anything. """
+
+        r = self.build_response(("John", "3", "16"), ("Psalms", "119", None))
+        message = r.construct_message()
+        self.assertTrue(message.startswith("The contents of the verse(s)"))
+        self.assertTrue("Psalms+119&version=ESV" in message)
+        self.assertTrue(self.server.requests == {})
+
+    def test_stop_fetching(self):
+        """ Tests that verses after the one that overflows the response
+        aren't fetched. """
+
+        response.MINIMUM_VERSE_LENGTH = 1
+        response.MAXIMUM_RESPONSE_LENGTH = 8000
+        r = self.build_response(("Psalms", "119", None), ("John", "3", "16"))
+        messages = self.send_progressively(r)
+        self.assertTrue(len(messages) == 1)
+        self.assertTrue(messages[0][0].startswith(
+            "The contents of the verse(s) you quoted exceed the %d character"
+            % response.MAXIMUM_RESPONSE_LENGTH))
+        self.assertTrue(self.server.requests == {"/passage/": 1})
+        self.assertTrue(r.verse_list[1].contents == "")
+
+    def test_overflow_after_sending(self):
+        """ Tests that verses past the response limit are linked to once the
+        earlier verses have been sent. """
+
+        r = self.build_response(("John", "3", "16"), ("Psalms", "119", None))
+        cache.passage_cache.put(
+            webparser.passage_key(r.verse_list[0]),
+            ("[**16**] For God so loved the world ", "ESV", "https://x"))
+        response.MINIMUM_VERSE_LENGTH = 1
+        response.MAXIMUM_RESPONSE_LENGTH = 8000
+        messages = self.send_progressively(r)
+        self.assertTrue(len(messages) == 2)
+        self.assertTrue("John 3:16" in messages[0][0])
+        self.assertTrue(messages[1][0].startswith(
+            "The verse(s) you quoted exceed the %d character limit. "
+            "Instead, here are links to the rest of them!"
+            % response.MAXIMUM_RESPONSE_LENGTH))
+        self.assertTrue("Psalms+119" in messages[1][0] and
+                        "John+3" not in messages[1][0])
+
+    def test_failed_fetch(self):
+        """ Tests that a fetch failing partway through a response is
+        answered with links to the verses not sent yet, and that no
+        failure goes unretrieved. """
+
+        r = self.build_response(("John", "3", "16"), ("Romans", "8", "28"),
+                                ("Genesis", "1", "1"))
+        cache.passage_cache.put(
+            webparser.passage_key(r.verse_list[0]),
+            ("[**16**] For God so loved the world ", "ESV", "https://x"))
+
+        def retrieve(verses):
+            raise ConnectionError("upstream timed out")
+
+        errors = list()
+        loop = asyncio.get_event_loop()
+        saved = webparser.retrieve_contents_batch, loop.get_exception_handler()
+        webparser.retrieve_contents_batch = retrieve
+        loop.set_exception_handler(lambda loop, context: errors.append(
+            context))
+        try:
+            messages = self.send_progressively(r)
+            gc.collect()
+            loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            webparser.retrieve_contents_batch = saved[0]
+            loop.set_exception_handler(saved[1])
+
+        self.assertTrue(len(messages) == 2)
+        self.assertTrue("John 3:16" in messages[0][0])
+        self.assertTrue(messages[1][0].startswith(
+            "The rest of the verse(s) you quoted couldn't be retrieved."))
+        self.assertTrue("Romans 8:28" in messages[1][0] and
+                        "Genesis 1:1" in messages[1][0])
+        self.assertTrue(errors == [])
+
+    def test_fitting_response(self):
+        """ Tests that responses that fit are fetched and quoted in order.
+        """
+
+        r = self.build_response(("John", "3", "16"), ("Romans", "8", "28"))
+        message = "".join(m for m, t in self.send_progressively(r))
+        self.assertTrue(message.index("John 3:16") <
+                        message.index("Romans 8:28"))
+        self.assertTrue("For God so loved the world" in message)
+
+    def send_progressively(self, r):
+        """ Sends a response progressively, returning the text and time of
+        every message. """
+
+        messages = list()
+
+        async def send(text):
+            messages.append((text, time.monotonic()))
+            return True
+
+        sent = asyncio.get_event_loop().run_until_complete(
+            r.send_progressively(send))
+        self.assertTrue(sent == len(messages))
+        return messages
+
+    def test_progressive_order(self):
+        """ Tests that progressive messages keep the order of the verses.
+        """
+
+        r = self.build_response(("John", "3", "16"), ("Psalms", "117", None),
+                                ("Romans", "8", "28"))
+        text = "".join(m for m, t in self.send_progressively(r))
+        self.assertTrue(text.index("John 3:16") < text.index("Psalms 117") <
+                        text.index("Romans 8:28"))
+
+    def test_first_message(self):
+        """ Tests that a ready verse is sent without waiting for a slow one.
+        """
+
+        r = self.build_response(("John", "3", "16"), ("Romans", "8", "28"))
+        cache.passage_cache.put(
+            webparser.passage_key(r.verse_list[0]),
+            ("[**16**] For God so loved the world ", "ESV", "https://x"))
+        self.server.latency = 0.3
+        start = time.monotonic()
+        messages = self.send_progressively(r)
+        self.assertTrue(len(messages) == 2)
+        self.assertTrue("John 3:16" in messages[0][0])
+        self.assertTrue(messages[0][1] - start < 0.2)
+        self.assertTrue("Romans 8:28" in messages[1][0])
+
+    def test_split_contents(self):
+        """ Tests that long contents are split between verse numbers. """
+
+        contents = "".join("[**%d**] %s " % (n, "word " * 30)
+                           for n in range(1, 51))
+        pieces = response.split_contents(contents, 1000)
+        self.assertTrue("".join(pieces) == contents)
+        self.assertTrue(all(len(p) <= 1000 for p in pieces))
+        self.assertTrue(all(p.startswith("[**") for p in pieces))
+
+
+class TestBatchFetching(StubServerTestCase):
+    """ Tests fetching the verses of a message that share a translation in
+    one BibleGateway request. """
+
+    def find_verses(self, body):
+        return [verse.Verse.from_reference(reference, "mgrieger",
+                                           "VerseBot")
+                for reference in regex.find_references(body)]
+
+    def test_combined_request(self):
+        """ Tests that two verses of one translation are fetched with a
+        single request and split back into their own contents. """
+
+        verses = self.find_verses("[John 3:16 esv][Romans 8:28 esv]")
+        results = asyncio.get_event_loop().run_until_complete(
+            asyncio.gather(*webparser.get_web_contents_futures(verses)))
+        self.assertTrue(self.server.requests == {"/passage/": 1})
+        self.assertTrue("For God so loved the world" in results[0][0])
+        self.assertTrue("[**28**]" not in results[0][0])
+        self.assertTrue("all things work together for good" in
+                        results[1][0])
+        self.assertTrue("[**16**]" not in results[1][0])
+        self.assertTrue(results[0][2].endswith("search=John+3&version=ESV"))
+        self.assertTrue(results[1][2].endswith(
+            "search=Romans+8&version=ESV"))
+
+    def test_unsplittable_page(self):
+        """ Tests that verses are fetched one at a time when the combined
+        page doesn't hold a passage for each of them. """
+
+        # BibleGateway drops references it can't find from the page
+        stubserver.PASSAGES[("Genesis 1:1;John 3:16", "ESV")] = \
+            "bible_gateway_john_3_16_esv.html"
+        self.addCleanup(stubserver.PASSAGES.pop,
+                        ("Genesis 1:1;John 3:16", "ESV"))
+
+        verses = self.find_verses("[Genesis 1:1 esv][John 3:16 esv]")
+        results = webparser.get_web_contents_batch(verses)
+        self.assertTrue(self.server.requests == {"/passage/": 3})
+        self.assertTrue("In the beginning, God created the heavens and the "
+                        "earth." in results[0][0])
+        self.assertTrue("For God so loved the world" in results[1][0])
+
+
+class TestChapterSlicing(unittest.TestCase):
+    """ Tests building verse contents out of a cached chapter. """
+
+    chapter = (((1, "[**1**] one "), (2, "[**2**] two "),
+                (3, "[**3**] three ")), "Title", "link")
+
+    def test_range_slice(self):
+        """ Tests slicing a verse range out of a chapter. """
+
+        v = verse.Verse("Genesis", "1", "esv", "mgrieger", "VerseBot",
+                        verse="2-3")
+        self.assertTrue(webparser.slice_chapter(self.chapter, v) ==
+                        ("[**2**] two [**3**] three ", "Title", "link"))
+
+    def test_whole_chapter_slice(self):
+        """ Tests that a whole chapter request returns every verse. """
+
+        v = verse.Verse("Genesis", "1", "esv", "mgrieger", "VerseBot",
+                        verse="")
+        self.assertTrue(webparser.slice_chapter(self.chapter, v)[0] ==
+                        "[**1**] one [**2**] two [**3**] three ")
+
+    def test_out_of_range_slice(self):
+        """ Tests that a range outside the chapter has no contents. """
+
+        v = verse.Verse("Genesis", "1", "esv", "mgrieger", "VerseBot",
+                        verse="9")
+        self.assertTrue(webparser.slice_chapter(self.chapter, v) ==
+                        (None, None, None))
+
+
+class TestTranslationCatalog(unittest.TestCase):
+    """ Tests translation lookup and validation. """
+
+    def setUp(self):
+        self.catalog = catalog.TranslationCatalog()
+        self.catalog.set_translations([
+            translation.Translation("English Standard Version", "ESV", "en"),
+            translation.Translation("JPS Tanakh", "JPS", "en", True, False,
+                                    False),
+            translation.Translation("New Revised Standard Version", "NRSV",
+                                    "en", True, True, True)])
+
+    def test_translation_lookup(self):
+        """ Tests retrieval of translations by abbreviation. """
+
+        self.assertTrue(self.catalog.get("esv").name ==
+                        "English Standard Version")
+        self.assertTrue(self.catalog.get("FOO") is None)
+
+    def test_translation_validation(self):
+        """ Tests that translations are only valid for the sections of the
+        Bible they contain. """
+
+        self.assertTrue(self.catalog.is_valid_trans("NRSV", "Deuterocanon"))
+        self.assertTrue(self.catalog.is_valid_trans("JPS", "Old Testament"))
+        self.assertFalse(self.catalog.is_valid_trans("JPS",
+                                                     "New Testament"))
+        self.assertFalse(self.catalog.is_valid_trans("FOO",
+                                                     "New Testament"))
+
+    def test_local_translations(self):
+        """ Tests that local translations are listed, take the place of a
+        fetched translation, and are kept through refreshes. """
+
+        self.catalog.add_local([
+            translation.Translation("King James Version", "KJV", "English"),
+            translation.Translation("Local ESV", "ESV", "English")])
+        self.catalog.set_translations([
+            translation.Translation("English Standard Version", "ESV", "en")])
+        self.assertTrue(self.catalog.get("kjv").name == "King James Version")
+        self.assertTrue(self.catalog.get("ESV").name == "Local ESV")
+        self.assertTrue(len(self.catalog.translations) == 2)
+
+
+class TestLocalTranslation(unittest.TestCase):
+    """ Tests converting and serving local translations. """
+
+    SOURCE = ["Genesis 1:1\tIn the beginning God created the heaven and "
+              "the earth.",
+              "John 3:17\tFor God sent not his Son into the world to "
+              "condemn the world; but that the world through him might be "
+              "saved.",
+              "",
+              "Jn 3:16\tFor God so loved the world, that he gave his only "
+              "begotten Son, that whosoever believeth in him should not "
+              "perish, but have everlasting life.",
+              "John 3:18\tHe that believeth on him is not condemned."]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "kjv.vbt")
+        self.assertTrue(localtranslation.convert(
+            self.SOURCE, path, "King James Version", "kjv") == 4)
+        self.local = localtranslation.LocalTranslations(self.directory.name)
+
+    def tearDown(self):
+        self.local = None
+        self.directory.cleanup()
+
+    def test_contents(self):
+        """ Tests that single verses, verse ranges and chapters are read in
+        canonical order. """
+
+        kjv = self.local.get("KJV")
+        self.assertTrue(kjv.title == "King James Version (KJV)")
+        v = verse.Verse("John", "3", "kjv", "mgrieger", "VerseBot",
+                        verse="16")
+        self.assertTrue(kjv.get_contents(v).startswith(
+            "[**16**] For God so loved the world"))
+        v = verse.Verse("John", "3", "kjv", "mgrieger", "VerseBot",
+                        verse="17-20")
+        self.assertTrue(kjv.get_contents(v).count("[**") == 2)
+        v = verse.Verse("John", "3", "kjv", "mgrieger", "VerseBot",
+                        verse=None)
+        self.assertTrue(kjv.get_contents(v).startswith("[**16**]"))
+        v = verse.Verse("Genesis", "2", "kjv", "mgrieger", "VerseBot",
+                        verse="1")
+        self.assertTrue(kjv.get_contents(v) is None)
+
+        entry = kjv.translation()
+        self.assertTrue(entry.has_section("Old Testament") and
+                        entry.has_section("New Testament") and
+                        not entry.has_section("Deuterocanon"))
+        self.assertTrue(list(kjv.verses())[0][:3] == ("Genesis", 1, 1))
+
+    def test_web_contents(self):
+        """ Tests that get_web_contents serves local translations. """
+
+        local_translations = webparser.local_translations
+        webparser.local_translations = self.local
+        try:
+            v = verse.Verse("John", "3", "kjv", "mgrieger", "VerseBot",
+                            verse="16")
+            contents, title, permalink = webparser.get_web_contents(v)
+            missing = webparser.get_local_contents(verse.Verse(
+                "Tobit", "1", "kjv", "mgrieger", "VerseBot", verse="1"))
+        finally:
+            webparser.local_translations = local_translations
+
+        self.assertTrue("begotten Son" in contents)
+        self.assertTrue(title == "King James Version (KJV)")
+        self.assertTrue(missing is None)
+
+    def test_byte_order(self):
+        """ Tests that keys are written little-endian like the preamble.
+        """
+
+        with open(os.path.join(self.directory.name, "kjv.vbt"), "rb") as f:
+            data = f.read()
+        magic, header_length, count = \
+            localtranslation.PREAMBLE.unpack_from(data)
+        start = localtranslation.PREAMBLE.size + \
+            localtranslation.padded(header_length)
+        self.assertTrue(struct.unpack_from("<I", data, start)[0] ==
+                        localtranslation.verse_key(1, 1, 1))
+
+    def test_invalid_source(self):
+        """ Tests that lines that aren't single verses are rejected. """
+
+        with self.assertRaises(ValueError):
+            localtranslation.read_source(["John 3:16-17\tFor God so"])
+
+
+class TestVersification(unittest.TestCase):
+    """ Tests checking references against the versification table. """
+
+    def test_impossible_references(self):
+        """ Tests that references that can't exist are rejected. """
+
+        self.assertTrue(versification.check_reference("Jude", 5, 1, 1)
+                        is None)
+        self.assertTrue(versification.check_reference("Psalms", 151, 200,
+                                                      200) is None)
+        self.assertTrue(versification.check_reference("John", 3, 40, 40)
+                        is None)
+
+    def test_clamped_references(self):
+        """ Tests that an ending verse past the end of the chapter is
+        clamped. """
+
+        self.assertTrue(versification.check_reference("John", 3, 16, 99) ==
+                        (16, 36))
+        self.assertTrue(versification.check_reference("John", 3, 0, 0) ==
+                        (0, 0))
+
+    def test_verse_validation(self):
+        """ Tests that verses outside the versification are not valid. """
+
+        v = verse.Verse("Jude", "5", "esv", "mgrieger", "VerseBot",
+                        verse="1")
+        self.assertFalse(v.valid)
+        v = verse.Verse("John", "3", "esv", "mgrieger", "VerseBot",
+                        verse="16-99")
+        self.assertTrue(v.valid and v.verse == "16-36")
+
+    def test_hebrew_versification(self):
+        """ Tests that verses only numbered in the Hebrew versification are
+        valid. """
+
+        v = verse.Verse("Numbers", "25", "jps", "mgrieger", "VerseBot",
+                        verse="19")
+        self.assertTrue(v.valid)
+        v = verse.Verse("Malachi", "3", "jps", "mgrieger", "VerseBot",
+                        verse="24")
+        self.assertTrue(v.valid)
+
+    def test_greek_additions(self):
+        """ Tests that the Greek chapters of Esther and Psalm 151 are
+        valid, and bounded by their own verse counts. """
+
+        self.assertTrue(versification.check_reference("Esther", 11, 1, 1) ==
+                        (1, 1))
+        self.assertTrue(versification.check_reference("Esther", 10, 4, 13) ==
+                        (4, 13))
+        self.assertTrue(versification.check_reference("Esther", 16, 20, 99) ==
+                        (20, 24))
+        self.assertTrue(versification.check_reference("Esther", 17, 1, 1) is
+                        None)
+        v = verse.Verse("Psalms", "151", "nrsv", "mgrieger", "VerseBot",
+                        verse="1-7")
+        self.assertTrue(v.valid and v.verse == "1-7")
+        v = verse.Verse("Esther", "14", "dra", "mgrieger", "VerseBot",
+                        verse="")
+        self.assertTrue(v.valid)
+        self.assertTrue(versification.check_reference("Psalms", 152, 1, 1)
+                        is None)
+
+
+class TestRateLimiting(unittest.TestCase):
+    """ Tests the outbound message rate limiter. """
+
+    def test_token_bucket(self):
+        """ Tests that a bucket allows a burst and then spaces out sends. """
+
+        bucket = ratelimit.TokenBucket(1.0, 2)
+        self.assertTrue(bucket.reserve() == 0)
+        self.assertTrue(bucket.reserve() == 0)
+        self.assertTrue(0.9 < bucket.reserve() <= 1.0)
+        self.assertTrue(1.9 < bucket.reserve() <= 2.0)
+
+
+class TestWorkQueue(unittest.TestCase):
+    """ Tests the bounded message queue. """
+
+    def run_queue(self, overflow):
+        handled = list()
+
+        async def handler(item):
+            handled.append(item)
+
+        async def fill():
+            queue = workqueue.WorkQueue(handler, workers=1, maxsize=2,
+                                        overflow=overflow,
+                                        workspace="T" + overflow)
+            accepted = [await queue.put(i) for i in range(4)]
+            queue.start()
+            await asyncio.sleep(0.01)
+            queue.stop()
+            return accepted, queue
+
+        loop = asyncio.new_event_loop()
+        try:
+            accepted, queue = loop.run_until_complete(fill())
+        finally:
+            loop.close()
+        return accepted, queue, handled
+
+    def test_drop_oldest(self):
+        """ Tests that a full queue discards the oldest message. """
+
+        accepted, queue, handled = self.run_queue(workqueue.DROP_OLDEST)
+        self.assertTrue(accepted == [True, True, True, True])
+        self.assertTrue(handled == [2, 3] and queue.dropped == 2)
+        self.assertTrue(metrics.queue_dropped_total.value(
+            workspace="T" + workqueue.DROP_OLDEST) == 2)
+        self.assertTrue(metrics.queue_depth.value(
+            workspace="T" + workqueue.DROP_OLDEST) == 0)
+        self.assertTrue(metrics.queue_wait_seconds.count(
+            workspace="T" + workqueue.DROP_OLDEST) == 2)
+        self.assertTrue("versebot_queue_dropped_total{workspace=\"Tdrop_"
+                        "oldest\"} 2" in metrics.registry.render())
+
+    def test_drop_newest(self):
+        """ Tests that a full queue rejects incoming messages. """
+
+        accepted, queue, handled = self.run_queue(workqueue.DROP_NEWEST)
+        self.assertTrue(accepted == [True, True, False, False])
+        self.assertTrue(handled == [0, 1] and queue.processed == 2)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """ Tests coalescing of identical in-flight calls. """
+
+    def test_shared_call(self):
+        """ Tests that concurrent calls with one key share a single call. """
+
+        flights = singleflight.SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = list()
+
+        def fetch(reference):
+            calls.append(reference)
+            started.set()
+            release.wait(5)
+            return reference.upper()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            first = executor.submit(flights.do, "john 3:16", fetch,
+                                    "john 3:16")
+            started.wait(5)
+            others = [executor.submit(flights.do, "john 3:16", fetch,
+                                      "john 3:16") for i in range(3)]
+            while flights.shared < 3:
+                time.sleep(0.001)
+            release.set()
+            results = [f.result() for f in [first] + others]
+
+        self.assertTrue(calls == ["john 3:16"])
+        self.assertTrue(results == ["JOHN 3:16"] * 4)
+        self.assertTrue(flights.in_flight() == 0)
+
+    def test_shared_exception(self):
+        """ Tests that a failed call isn't remembered after it finishes. """
+
+        flights = singleflight.SingleFlight()
+
+        def fail():
+            raise ValueError("not found")
+
+        self.assertRaises(ValueError, flights.do, "key", fail)
+        self.assertTrue(flights.do("key", lambda: 1) == 1)
+
+
+class TestLoadGenerator(StubServerTestCase):
+    """ Tests VerseBot against the local Slack stand-in. """
+
+    def run_load(self, events, mix):
+        """ Runs a VerseBot against a FakeSlack replaying a stream, and
+        returns the results. """
+
+        slack = fakeslack.FakeSlack(rate=200, events=events, mix=mix)
+        slack.start()
+        try:
+            bots = loadgen.run(slack, 1, True, 10)
+        finally:
+            slack.stop()
+
+        return loadgen.collect(slack, bots)
+
+    def test_replies_across_reconnects(self):
+        """ Tests that every mention is answered while errors and
+        disconnects force VerseBot to reconnect. """
+
+        results = self.run_load(40, {
+            fakeslack.MENTION: 0.5, fakeslack.NON_MENTION: 0.3,
+            fakeslack.ERROR: 0.1, fakeslack.DISCONNECT: 0.1})
+        self.assertTrue(results["mentions"] == 20)
+        self.assertTrue(results["unanswered"] == 0)
+        self.assertTrue(results["duplicates"] == 0)
+        self.assertTrue(results["connections"] == 9)
+        self.assertTrue(results["refused"] == 0)
+
+    def test_reconnect_new_session(self):
+        """ Tests that VerseBot starts a new RTM session to reconnect, since
+        a second connection to the url of the first is refused. """
+
+        results = self.run_load(10, {
+            fakeslack.MENTION: 0.5, fakeslack.NON_MENTION: 0.4,
+            fakeslack.DISCONNECT: 0.1})
+        self.assertTrue(results["mentions"] == 5)
+        self.assertTrue(results["unanswered"] == 0)
+        self.assertTrue(results["connections"] == 2)
+        self.assertTrue(results["refused"] == 0)
+
+
+class TestReplyConnection(StubServerTestCase):
+    """ Tests which connection replies are sent on. """
+
+    def test_reply_after_reconnect(self):
+        """ Tests that a reply made while reconnecting is sent on the next
+        connection. """
+
+        class Recorder:
+            def __init__(self):
+                self.sent = list()
+
+            async def send(self, data):
+                self.sent.append(data)
+
+        bot = loadgen.VerseBot("T0TEAM", object())
+        bot.set_connection(None)
+        websocket = Recorder()
+
+        async def reconnect():
+            await asyncio.sleep(0.05)
+            bot.set_connection(websocket)
+
+        loop = asyncio.get_event_loop()
+        sent, _ = loop.run_until_complete(asyncio.gather(
+            bot.send_message("reply", "C0CHANNEL"), reconnect()))
+        self.assertTrue(sent)
+        self.assertTrue(len(websocket.sent) == 1)
+        self.assertTrue('"reply"' in websocket.sent[0])
+
+    def test_dropped_reply_stats(self):
+        """ Tests that a reply is only counted in the usage stats once it
+        has been sent. """
+
+        class Recorder:
+            async def send(self, data):
+                pass
+
+        bot = loadgen.VerseBot("T0TEAM", object())
+        body = "[John 3:16 esv]"
+        cache.passage_cache.put(
+            webparser.passage_key(verse.Verse.from_reference(
+                regex.find_references(body)[0], "U0USER", "C0CHANNEL")),
+            ("[**16**] For God so loved the world ", "ESV", "https://x"))
+        loop = asyncio.get_event_loop()
+
+        saved = versebot.SEND_TIMEOUT
+        versebot.SEND_TIMEOUT = 0.01
+        bot.set_connection(None)
+        try:
+            loop.run_until_complete(bot.send_verses(
+                body, regex.find_references(body), "U0USER", "C0CHANNEL"))
+        finally:
+            versebot.SEND_TIMEOUT = saved
+        stats.usage_stats.flush()
+        self.assertFalse(os.path.exists(stats.usage_stats.path))
+
+        bot.set_connection(Recorder())
+        loop.run_until_complete(bot.send_verses(
+            body, regex.find_references(body), "U0USER", "C0CHANNEL"))
+        stats.usage_stats.flush()
+        self.assertTrue(os.path.exists(stats.usage_stats.path))
+
+    def test_acks_with_pings(self):
+        """ Tests that acknowledgements received while waiting for a pong,
+        or while a reply is being sent, are all read. """
+
+        class Echo:
+            def __init__(self):
+                self.incoming = asyncio.Queue()
+
+            async def send(self, data):
+                data = json.loads(data)
+                if data["type"] == "ping":
+                    self.incoming.put_nowait(json.dumps({"reply_to": 1}))
+                    self.incoming.put_nowait(json.dumps(
+                        {"type": "pong", "reply_to": data["id"]}))
+                else:
+                    self.incoming.put_nowait(json.dumps(
+                        {"ok": True, "reply_to": data["id"]}))
+                    await asyncio.sleep(0.01)
+
+            async def recv(self):
+                return await self.incoming.get()
+
+        bot = loadgen.VerseBot("T0TEAM", object())
+        websocket = Echo()
+        bot.set_connection(websocket)
+        bot.next_id = 2
+        bot.unacked_messages[1] = (time.monotonic(), {"id": 1})
+
+        async def run():
+            receiver = asyncio.ensure_future(bot._receive(websocket))
+            await asyncio.sleep(0.05)
+            sent = await bot.send_message("reply", "C0CHANNEL")
+            await asyncio.sleep(0.05)
+            receiver.cancel()
+            return sent
+
+        saved = versebot.TIMEOUT
+        versebot.TIMEOUT = 0.01
+        try:
+            sent = asyncio.get_event_loop().run_until_complete(run())
+        finally:
+            versebot.TIMEOUT = saved
+        self.assertTrue(sent)
+        self.assertTrue(len(bot.unacked_messages) == 0)
+
+    def test_stale_resends(self):
+        """ Tests that only recent unacknowledged replies are sent again.
+        """
+
+        class Recorder:
+            def __init__(self):
+                self.sent = list()
+
+            async def send(self, data):
+                self.sent.append(json.loads(data))
+
+        bot = loadgen.VerseBot("T0TEAM", object())
+        websocket = Recorder()
+        now = time.monotonic()
+        bot.unacked_messages[1] = (now - versebot.RESEND_TIMEOUT - 1,
+                                   {"id": 1, "channel": "C0CHANNEL"})
+        bot.unacked_messages[2] = (now, {"id": 2, "channel": "C0CHANNEL"})
+        asyncio.get_event_loop().run_until_complete(
+            bot.resend_unacked(websocket))
+        self.assertTrue([m["id"] for m in websocket.sent] == [2])
+        self.assertTrue(list(bot.unacked_messages) == [2])
+
+
+class TestVerseBotRunner(StubServerTestCase):
+    """ Tests running a VerseBot for every token. """
+
+    def test_restart(self):
+        """ Tests that a bot that fails to connect is restarted, and that
+        removing its token cancels the restart. """
+
+        calls = list()
+
+        async def connect(bot):
+            calls.append(bot)
+            raise ConnectionError("refused")
+
+        saved = versebot.VerseBot.connect, versebot.RESTART_DELAY
+        versebot.VerseBot.connect = connect
+        versebot.RESTART_DELAY = 0.01
+        loop = asyncio.get_event_loop()
+        runner = versebot.VerseBotRunner(loop=loop)
+        try:
+            runner.add_token("xoxb-test")
+            loop.run_until_complete(asyncio.sleep(0.1))
+        finally:
+            versebot.VerseBot.connect, versebot.RESTART_DELAY = saved
+
+        self.assertTrue(len(calls) >= 3)
+        self.assertTrue("xoxb-test" in runner.bots or
+                        "xoxb-test" in runner.restarts)
+        runner.remove_token("xoxb-test")
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertTrue(not runner.bots and not runner.restarts)
+
+
+class TestUsageStats(unittest.TestCase):
+    """ Tests the batched usage statistics. """
+
+    def test_flush(self):
+        """ Tests that counts are only written on flush, and are added to
+        the seeded and earlier rows. """
+
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, "test.sqlite")
+        usage = stats.UsageStats(path, interval=None)
+        first = verse.Verse("John", "3", "esv", "mgrieger", "VerseBot",
+                            verse="16")
+        second = verse.Verse("Genesis", "1", "kjv", "mgrieger", "VerseBot",
+                             verse="1")
+        usage.record([first, second], "T0TEAM", "C0CHANNEL")
+        usage.record([first], "T0TEAM", "C1CHANNEL")
+        self.assertFalse(os.path.exists(path))
+
+        usage.flush()
+        usage.record([first], "T0TEAM", "C0CHANNEL")
+        usage.flush()
+
+        connection = sqlite3.connect(path)
+        self.assertTrue(connection.execute(
+            "SELECT t_count FROM book_stats WHERE book = 'John'")
+            .fetchone()[0] == 3)
+        self.assertTrue(connection.execute(
+            "SELECT t_count FROM translation_stats WHERE trans = 'KJV'")
+            .fetchone()[0] == 1)
+        self.assertTrue(dict(connection.execute(
+            "SELECT sub, t_count FROM subreddit_stats")) == {
+            "T0TEAM": 3, "T0TEAM/C0CHANNEL": 2, "T0TEAM/C1CHANNEL": 1})
+        self.assertTrue(connection.execute(
+            "SELECT t_count, last_used IS NOT NULL FROM comment_count")
+            .fetchall() == [(3, 1)])
+        connection.close()
+        directory.cleanup()
+
+
+class TestDefaultTranslations(unittest.TestCase):
+    """ Tests the cached per-user and per-channel default translations. """
+
+    def test_defaults(self):
+        """ Tests that user defaults take precedence over channel defaults,
+        section by section, and that defaults edited in the database are
+        read on reload. """
+
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, "test.sqlite")
+        stored = defaults.DefaultTranslations(path)
+        self.assertTrue(stored.get("U0USER", "C0CHANNEL",
+                                   "New Testament") is None)
+        self.assertFalse(os.path.exists(path))
+
+        connection = sqlite3.connect(path)
+        store.create_missing_tables(connection, defaults.DEFAULTS_TABLES)
+        with connection:
+            connection.execute(
+                "INSERT INTO subreddit_translations (sub, ot_default, "
+                "nt_default, deut_default) VALUES (?, ?, ?, ?)",
+                ("C0CHANNEL", "JPS", "KJV", None))
+            connection.execute(
+                "INSERT INTO user_translations (username, ot_default, "
+                "nt_default, deut_default) VALUES (?, ?, ?, ?)",
+                ("U0USER", "NASB", "NIV", None))
+        connection.close()
+        self.assertTrue(stored.get("U0USER", "C0CHANNEL",
+                                   "New Testament") is None)
+
+        stored.load()
+        self.assertTrue(stored.get("U0USER", "C0CHANNEL",
+                                   "New Testament") == "NIV")
+        self.assertTrue(stored.get("U0USER", "C1CHANNEL",
+                                   "Old Testament") == "NASB")
+        self.assertTrue(stored.get("U1USER", "C0CHANNEL",
+                                   "Old Testament") == "JPS")
+        self.assertTrue(stored.get("U0USER", "C0CHANNEL",
+                                   "Deuterocanon") is None)
+
+        default_translations = verse.default_translations
+        verse.default_translations = stored
+        try:
+            v = verse.Verse("John", "3", None, "U0USER", "C0CHANNEL",
+                            verse="16")
+            self.assertTrue(v.translation == "NIV")
+            v = verse.Verse("Tobit", "1", None, "U0USER", "C0CHANNEL",
+                            verse="1")
+            self.assertTrue(v.translation == "NRSV")
+        finally:
+            verse.default_translations = default_translations
+        directory.cleanup()
+
+
+class TestQuoteIndex(StubServerTestCase):
+    """ Tests answering quoted-text searches from the local index. """
+
+    def test_search(self):
+        """ Tests that indexed verses are found by phrase in their own
+        translation, regardless of punctuation and formatting, and that
+        short quotes aren't answered locally. """
+
+        index = quoteindex.QuoteIndex(os.path.join(self.directory.name,
+                                                   "index.sqlite"))
+        v = verse.Verse("John", "3", "esv", "mgrieger", "VerseBot",
+                        verse="16-17")
+        index.add_passage(v, "[**16**] For God so loved the world, that he "
+                             "gave his only Son, that whoever believes in "
+                             "him should not perish but have eternal life. "
+                             "[**17**] For God did not send his Son into "
+                             "the world to condemn the world ")
+        index.flush()
+
+        self.assertTrue(index.search("“For God so loved the world\"",
+                                     "ESV") == "John 3:16")
+        self.assertTrue(index.search("send his Son into the world",
+                                     "esv") == "John 3:17")
+        self.assertTrue(index.search("send his Son into the world",
+                                     "KJV") is None)
+        self.assertTrue(index.search("so loved the Son", "ESV") is None)
+        self.assertTrue(index.search("God so", "ESV") is None)
+
+    def test_remote_fallback(self):
+        """ Tests that quotes missing from the index are searched on
+        BibleGateway, and that every result is added to the index. """
+
+        self.assertTrue(webparser.search_bible_gateway(
+            "whoever believes in him") == "John 3:16")
+        webparser.quote_index.flush()
+        self.assertTrue(webparser.search_bible_gateway(
+            "God sent his only Son into the world") == "1 John 4:9")
+        self.assertTrue(self.server.requests["/quicksearch/"] == 1)
+
+
+class TestMetrics(unittest.TestCase):
+    """ Tests the Prometheus text export. """
+
+    def test_histogram_and_counter(self):
+        """ Tests that observations land in cumulative buckets and that
+        label values are escaped. """
+
+        registry = metrics.Registry()
+        latency = registry.register(metrics.Histogram(
+            "test_seconds", "Test latency.", ["stage"], buckets=(0.1, 1.0)))
+        count = registry.register(metrics.Counter(
+            "test_total", "Test count.", ["workspace"]))
+        latency.observe(0.05, stage="fetch")
+        latency.observe(0.5, stage="fetch")
+        latency.observe(5, stage="fetch")
+        count.inc(workspace='say "hi"')
+
+        lines = registry.render().splitlines()
+        self.assertTrue('test_seconds_bucket{stage="fetch",le="0.1"} 1'
+                        in lines)
+        self.assertTrue('test_seconds_bucket{stage="fetch",le="1.0"} 2'
+                        in lines)
+        self.assertTrue('test_seconds_bucket{stage="fetch",le="+Inf"} 3'
+                        in lines)
+        self.assertTrue('test_seconds_count{stage="fetch"} 3' in lines)
+        self.assertTrue('test_total{workspace="say \\"hi\\""} 1' in lines)
+
+
 class TestRegex(unittest.TestCase):
     """ Tests regular expressions. """
     
@@ -66,6 +1146,19 @@ class TestRegex(unittest.TestCase):
             "Testing testing! [genesis 5:3-5 (nrsv)]") is not None)
         self.assertTrue(regex.find_verses("[genesis (nrsv)") is None)
 
+    def test_reference_scanner(self):
+        """ Tests that quotations are parsed into typed references. """
+
+        references = regex.find_references(
+            "Testing testing! [genesis 5:3-5 (nrsv)] [1 Jn 4:8] [foo 1:1] "
+            "[John 3:17-16]")
+        self.assertTrue(len(references) == 3)
+        self.assertTrue(references[0].book.name == "Genesis")
+        self.assertTrue(references[0][1:] == (5, "3-5", 3, 5, "NRSV"))
+        self.assertTrue(references[1][1:] == (4, "8", 8, 8, None))
+        self.assertTrue(references[2].verse is None)
+        self.assertTrue(regex.find_references("[genesis (nrsv)") is None)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,165 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+cache.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Maximum combined length (in characters) of every cached passage
+MAX_CACHE_SIZE = 16 * 1024 * 1024
+
+# Time (seconds) a cached passage stays valid
+CACHE_TTL = 24 * 60 * 60
+
+
+class PassageCache:
+    """ A thread-safe, size-bounded LRU cache with per-entry expiry. Each
+    entry is charged the combined length of its string values, and the least
+    recently used entries are evicted once the total exceeds max_size. """
+
+    def __init__(self, max_size=MAX_CACHE_SIZE, ttl=CACHE_TTL):
+        """ Initializes an empty cache. """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the value cached under key, or None if it is missing or
+        has expired.
+
+        :param key: The key to look up
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key):
+        """ Returns the value cached under key, or None if it is missing or
+        has expired, without counting the lookup or refreshing the entry.
+
+        :param key: The key to look up
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def put(self, key, value):
+        """ Stores value under key, evicting least recently used entries
+        until the cache fits within max_size. Values larger than the whole
+        cache are not stored.
+
+        :param key: The key to store the value under
+        :param value: A tuple of strings, or of nested tuples of strings
+        """
+
+        size = entry_size(value)
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.size += size
+
+            while self.size > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """ Removes every entry from the cache. Counters are kept. """
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """ Returns a dictionary of the cache's counters. """
+
+        with self._lock:
+            return {"entries": len(self._entries), "size": self.size,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        """ Removes an entry. The caller must hold the lock. """
+
+        value, size, expires = self._entries.pop(key)
+        self.size -= size
+
+
+def entry_size(value):
+    """ Returns the number of characters a cached value is charged for.
+
+    :param value: A tuple of strings, or of nested tuples of strings (other
+        members are not charged)
+    """
+
+    size = 0
+    for v in value:
+        if isinstance(v, str):
+            size += len(v)
+        elif isinstance(v, tuple):
+            size += entry_size(v)
+    return size
+
+
+def passage_key(verse):
+    """ Returns the cache key for the contents of a verse.
+
+    :param verse: The verse to build the key for
+    """
+
+    return (verse.book, verse.chapter, verse.start_verse, verse.end_verse,
+            verse.translation)
+
+
+def chapter_key(verse):
+    """ Returns the cache key for the chapter a verse belongs to.
+
+    :param verse: The verse to build the key for
+    """
+
+    return verse.book, verse.chapter, verse.translation
+
+
+# Fetched passages, as (contents, translation title, permalink) tuples
+passage_cache = PassageCache()
+
+# Parsed chapters, as (verses, translation title, permalink) tuples where
+# verses is a tuple of (verse number, text) pairs
+chapter_cache = PassageCache()
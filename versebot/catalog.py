@@ -0,0 +1,192 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+catalog.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from translation import Translation
+
+# Local snapshot of the supported translations
+SNAPSHOT_PATH = "translations.json"
+
+# Time (seconds) between refreshes of the supported translations
+REFRESH_INTERVAL = 24 * 60 * 60
+
+# Time (seconds) to wait before retrying a failed refresh
+RETRY_INTERVAL = 10 * 60
+
+
+class TranslationCatalog:
+    """ Process-wide list of supported translations. The list is loaded from
+    a local snapshot as soon as the catalog is started, and refreshed from
+    BibleGateway by a background thread every REFRESH_INTERVAL seconds. """
+
+    def __init__(self, path=SNAPSHOT_PATH, interval=REFRESH_INTERVAL):
+        """ Initializes an empty TranslationCatalog. """
+
+        self.path = path
+        self.interval = interval
+        self.translations = tuple()
+        self.index = dict()
+        self.log = logging.getLogger("versebot")
+        self.fetched = tuple()
+        self.local = dict()
+        self._fetch = None
+        self._refresher = None
+        self._lock = threading.Lock()
+
+    def start(self, fetch):
+        """ Loads the local snapshot and starts the background refresh
+        thread. Calling start again has no effect.
+
+        :param fetch: Function that returns a fresh list of Translations
+        """
+
+        with self._lock:
+            if self._refresher is not None:
+                return
+
+            self._fetch = fetch
+            self.load_snapshot()
+            self._refresher = threading.Thread(target=self._refresh_forever,
+                                               daemon=True)
+            self._refresher.start()
+
+    def refresh(self):
+        """ Fetches the supported translations and saves them to the
+        snapshot. Returns True if the refresh succeeded. """
+
+        try:
+            translations = self._fetch()
+        except Exception as e:
+            self.log.error("translation refresh failed: " + str(e))
+            return False
+
+        if not translations:
+            return False
+
+        self.set_translations(translations)
+        self.save_snapshot()
+        return True
+
+    def set_translations(self, translations):
+        """ Replaces the list of supported translations.
+
+        :param translations: The new list of Translations
+        """
+
+        self.fetched = tuple(translations)
+        self._merge()
+
+    def add_local(self, translations):
+        """ Adds translations that are served locally. They are kept through
+        refreshes, and replace a fetched translation with the same
+        abbreviation.
+
+        :param translations: The local Translations
+        """
+
+        for t in translations:
+            self.local[t.abbreviation.upper()] = t
+        self._merge()
+
+    def _merge(self):
+        """ Rebuilds the list of supported translations out of the fetched
+        and local ones. """
+
+        merged = dict((t.abbreviation.upper(), t) for t in self.fetched)
+        merged.update(self.local)
+        translations = tuple(sorted(
+            merged.values(), key=lambda t: len(t.abbreviation),
+            reverse=True))
+        self.index = {t.abbreviation.upper(): t for t in translations}
+        self.translations = translations
+
+    def get(self, abbreviation):
+        """ Returns the Translation with the given abbreviation, or None if
+        it isn't supported.
+
+        :param abbreviation: The translation abbreviation, in any case
+        """
+
+        return self.index.get(abbreviation.upper())
+
+    def is_valid_trans(self, abbreviation, bible_section):
+        """ Returns true if the translation is supported and contains the
+        given section of the Bible, returns false otherwise. Until the
+        fetched translations have been loaded every translation is accepted,
+        so that requests aren't rewritten based on an incomplete list.
+
+        :param abbreviation: The translation abbreviation, in any case
+        :param bible_section: "Old Testament", "New Testament" or
+            "Deuterocanon"
+        """
+
+        if not self.fetched:
+            return True
+
+        translation = self.index.get(abbreviation.upper())
+        return translation is not None and translation.has_section(
+            bible_section)
+
+    def load_snapshot(self):
+        """ Loads the supported translations from the local snapshot, if one
+        exists. """
+
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        self.set_translations([Translation(**e) for e in entries])
+
+    def save_snapshot(self):
+        """ Writes the supported translations to the local snapshot. """
+
+        entries = [{"name": t.name, "abbreviation": t.abbreviation,
+                    "language": t.language, "has_ot": t.has_ot,
+                    "has_nt": t.has_nt, "has_deut": t.has_deut}
+                   for t in self.fetched]
+
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(entries, f, indent=1)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self.log.error("failed to save translation snapshot: " + str(e))
+
+    def snapshot_age(self):
+        """ Returns the age (seconds) of the local snapshot, or None if there
+        isn't one. """
+
+        try:
+            return time.time() - os.path.getmtime(self.path)
+        except OSError:
+            return None
+
+    def _refresh_forever(self):
+        """ Refreshes the supported translations whenever the snapshot is
+        older than the refresh interval. """
+
+        age = self.snapshot_age()
+        if self.fetched and age is not None and age < self.interval:
+            time.sleep(self.interval - age)
+
+        while True:
+            if self.refresh():
+                time.sleep(self.interval)
+            else:
+                time.sleep(RETRY_INTERVAL)
+
+
+# Translation catalog, snapshotted to SNAPSHOT_PATH
+translation_catalog = TranslationCatalog()
@@ -0,0 +1,116 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+defaults.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+
+from store import DATABASE_PATH
+
+# Default translation tables, and the script in sql/ that creates each
+DEFAULTS_TABLES = (("user_translations", "create_user_translations_table.sql"),
+                   ("subreddit_translations",
+                    "create_subreddit_translations_table.sql"))
+
+# Position of each section of the Bible in a (OT, NT, Deut) defaults tuple
+SECTIONS = {"Old Testament": 0, "New Testament": 1, "Deuterocanon": 2}
+
+
+class DefaultTranslations:
+    """ Per-user and per-channel default translations, read from the
+    user_translations and subreddit_translations tables. Both tables are
+    read into memory the first time a default is looked up, and again on
+    every call to load(), so defaults edited in the database apply without
+    a restart. Lookups never touch the database. Channels are stored in
+    subreddit_translations. """
+
+    def __init__(self, path=DATABASE_PATH):
+        """ Initializes a DefaultTranslations. Nothing is read until the
+        first lookup. """
+
+        self.path = path
+        self.log = logging.getLogger("versebot")
+        self._users = None
+        self._channels = None
+        self._lock = threading.Lock()
+
+    def get(self, user, channel, bible_section):
+        """ Returns the default translation of the user for a section of the
+        Bible, falling back to the default of the channel. Returns None if
+        neither has one.
+
+        :param user: The user that called VerseBot for a quotation
+        :param channel: The channel where the quotation is located
+        :param bible_section: "Old Testament", "New Testament" or
+            "Deuterocanon"
+        """
+
+        if self._users is None:
+            self.load()
+
+        section = SECTIONS.get(bible_section)
+        if section is None:
+            return None
+
+        for defaults in (self._users.get(user), self._channels.get(channel)):
+            if defaults is not None and defaults[section]:
+                return defaults[section]
+        return None
+
+    def load(self):
+        """ Reads every default from the database into memory, replacing
+        the defaults read before. A missing database file is treated as
+        having no defaults, and isn't created. """
+
+        users = dict()
+        channels = dict()
+        if os.path.exists(self.path):
+            try:
+                connection = sqlite3.connect(self.path, timeout=10)
+                try:
+                    users = read_defaults(connection, "user_translations",
+                                          "username")
+                    channels = read_defaults(connection,
+                                             "subreddit_translations", "sub")
+                finally:
+                    connection.close()
+            except sqlite3.Error as e:
+                self.log.error("default translations unavailable: " +
+                               str(e))
+
+        # The channels are replaced first, since a lookup that finds users
+        # doesn't load
+        with self._lock:
+            self._channels = channels
+            self._users = users
+
+
+def read_defaults(connection, table, column):
+    """ Returns a dictionary of the (OT, NT, Deut) defaults in a table, by
+    the value of column. Returns an empty dictionary if the table doesn't
+    exist.
+
+    :param connection: Connection to the database
+    :param table: user_translations or subreddit_translations
+    :param column: The column identifying a row
+    """
+
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (table,)).fetchone()
+    if exists is None:
+        return dict()
+
+    rows = connection.execute(
+        "SELECT %s, ot_default, nt_default, deut_default FROM %s "
+        "ORDER BY id" % (column, table))
+    return dict((row[0], tuple(row[1:])) for row in rows)
+
+
+# Default translations read from DATABASE_PATH
+default_translations = DefaultTranslations()
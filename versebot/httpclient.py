@@ -0,0 +1,89 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+httpclient.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Time (seconds) to wait for a connection to be established
+CONNECT_TIMEOUT = 5.0
+
+# Time (seconds) to wait between bytes of a response
+READ_TIMEOUT = 15.0
+
+# Number of hosts whose connection pools are kept
+POOL_HOSTS = 4
+
+# Maximum number of open connections to a single host
+POOL_SIZE_PER_HOST = 16
+
+# Number of times a failed connection is retried
+MAX_RETRIES = 1
+
+HEADERS = {"User-Agent": "VerseBot for Slack",
+           "Accept-Encoding": "gzip, deflate"}
+
+
+class HttpClient:
+    """ Shared HTTP client that keeps connections to every host alive
+    between requests. At most pool_size connections are opened to a host;
+    further requests wait for a free connection. """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, pool_size=POOL_SIZE_PER_HOST):
+        """ Initializes an HttpClient. The session is created on first use.
+        """
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """ The pooled session, created on first use. """
+
+        with self._lock:
+            if self._session is None:
+                self._session = self._create_session()
+            return self._session
+
+    def get(self, url, params=None):
+        """ Fetches a page and returns its decoded body as bytes. Raises
+        requests.RequestException if the page can't be fetched or the server
+        returns an error status.
+
+        :param url: The URL to fetch
+        :param params: Optional dictionary of query parameters
+        """
+
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def close(self):
+        """ Closes every pooled connection. """
+
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _create_session(self):
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS,
+                              pool_maxsize=self.pool_size, pool_block=True,
+                              max_retries=MAX_RETRIES)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(HEADERS)
+        return session
+
+
+# HTTP client used for every fetch
+http_client = HttpClient()
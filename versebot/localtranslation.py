@@ -0,0 +1,311 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+localtranslation.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+
+Public domain translations served from local files instead of the web. A
+plain text translation is converted once with:
+    python localtranslation.py SOURCE --abbreviation KJV
+        --name "King James Version" [--language English] [--output FILE]
+where every line of SOURCE is a reference and the text of that verse,
+separated by a tab, e.g. "Genesis 1:1<TAB>In the beginning God created the
+heaven and the earth." Book names are read like in a Slack message.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from quoteindex import quote_index
+from regex import find_references
+from translation import Translation
+
+# Directory holding the converted translations
+LOCAL_TRANSLATIONS_PATH = os.environ.get(
+    "VERSEBOT_LOCAL_TRANSLATIONS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                 "translations"))
+
+EXTENSION = ".vbt"
+
+# A file starts with the magic, the length of the JSON header and the
+# number of verses. After the header come the key of every verse, the
+# offset of every verse in the text (plus one for the end of the text), and
+# the text itself. Every section starts on a four byte boundary, and the
+# keys and offsets are little-endian unsigned ints like the preamble, so on
+# little-endian machines they are read straight out of the mapped file.
+MAGIC = b"VBT1"
+PREAMBLE = struct.Struct("<4sII")
+
+
+class LocalTranslation:
+    """ A converted translation, memory mapped. Verses are stored in
+    canonical order with their contents already formatted, so a verse range
+    is a single slice of the file, found by a binary search of the keys. """
+
+    def __init__(self, path):
+        """ Maps a converted translation.
+
+        :param path: The converted file
+        """
+
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_length, count = PREAMBLE.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a converted translation" % path)
+
+        start = PREAMBLE.size
+        self.header = json.loads(
+            self._map[start:start + header_length].decode("utf-8"))
+        start += padded(header_length)
+        self._keys = read_uints(self._map, start, count)
+        start += 4 * count
+        self._offsets = read_uints(self._map, start, count + 1)
+        self._text = start + 4 * (count + 1)
+
+        self.abbreviation = self.header["abbreviation"]
+        self.title = self.header["title"]
+
+    def translation(self):
+        """ Returns the catalog entry of the translation. """
+
+        return Translation(self.header["name"], self.abbreviation,
+                           self.header["language"], self.header["has_ot"],
+                           self.header["has_nt"], self.header["has_deut"])
+
+    def get_contents(self, verse):
+        """ Returns the contents of a verse, or None if the translation
+        doesn't have it.
+
+        :param verse: The verse to get the contents for
+        """
+
+        if verse.verse is None:
+            first = verse_key(verse.book_number, verse.chapter, 0)
+            last = verse_key(verse.book_number, verse.chapter, 1023)
+        else:
+            first = verse_key(verse.book_number, verse.chapter,
+                              verse.start_verse)
+            last = verse_key(verse.book_number, verse.chapter,
+                             verse.end_verse)
+
+        start = bisect_left(self._keys, first)
+        end = bisect_left(self._keys, last + 1, start)
+        if start == end:
+            return None
+
+        return self._map[self._text + self._offsets[start]:
+                         self._text + self._offsets[end]].decode("utf-8")
+
+    def verses(self):
+        """ Yields the (book, chapter, verse number, text) of every verse,
+        with the text formatted as message contents. """
+
+        names = self.header["books"]
+        for i, key in enumerate(self._keys):
+            text = self._map[self._text + self._offsets[i]:
+                             self._text + self._offsets[i + 1]]
+            yield (names[str(key >> 20)], (key >> 10) & 1023, key & 1023,
+                   text.decode("utf-8"))
+
+
+class LocalTranslations:
+    """ Every converted translation in a directory, keyed by abbreviation.
+    The directory is read the first time a translation is looked up. """
+
+    def __init__(self, path=LOCAL_TRANSLATIONS_PATH):
+        self.path = path
+        self.log = logging.getLogger("versebot")
+        self._translations = None
+        self._lock = threading.Lock()
+
+    def get(self, abbreviation):
+        """ Returns the LocalTranslation with the given abbreviation, or
+        None if it isn't served locally.
+
+        :param abbreviation: The upper case translation abbreviation
+        """
+
+        if self._translations is None:
+            self.load()
+        return self._translations.get(abbreviation)
+
+    def translations(self):
+        """ Returns the catalog entries of every local translation. """
+
+        if self._translations is None:
+            self.load()
+        return [t.translation() for t in self._translations.values()]
+
+    def load(self):
+        """ Maps every converted translation in the directory. """
+
+        translations = dict()
+        for path in sorted(glob.glob(os.path.join(self.path,
+                                                  "*" + EXTENSION))):
+            try:
+                local = LocalTranslation(path)
+            except (OSError, ValueError, KeyError) as e:
+                self.log.error("failed to load %s: %s" % (path, str(e)))
+                continue
+            translations[local.abbreviation.upper()] = local
+
+        with self._lock:
+            if self._translations is None:
+                self._translations = translations
+
+
+def verse_key(book_number, chapter, verse):
+    """ Returns the sort key of a verse. Chapters and verses are below 1024
+    in every book.
+
+    :param book_number: The number of the book
+    :param chapter: The chapter number
+    :param verse: The verse number
+    """
+
+    return (book_number << 20) | (chapter << 10) | verse
+
+
+def read_uints(buffer, start, count):
+    """ Returns count little-endian unsigned ints of a buffer. They are
+    read in place on little-endian machines, and copied otherwise.
+
+    :param buffer: The buffer to read
+    :param start: Offset of the first int
+    :param count: Number of ints to read
+    """
+
+    view = memoryview(buffer)[start:start + 4 * count]
+    if sys.byteorder == "little":
+        return view.cast("I")
+
+    values = array("I")
+    values.frombytes(view)
+    values.byteswap()
+    return values
+
+
+def padded(length):
+    """ Returns length rounded up to a multiple of four. """
+
+    return (length + 3) & ~3
+
+
+def read_source(lines):
+    """ Parses the lines of a plain text translation. Returns a dictionary
+    of the text of every verse by key, and the names of the books by book
+    number. Blank lines are skipped.
+
+    :param lines: Lines of "reference<TAB>text"
+    """
+
+    verses = dict()
+    books = dict()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        reference, tab, text = line.partition("\t")
+        references = find_references("[" + reference.strip() + "]")
+        if not tab or not references or references[0].verse is None or \
+                references[0].start_verse != references[0].end_verse:
+            raise ValueError("line %d is not a verse: %s" % (number, line))
+
+        r = references[0]
+        verses[verse_key(r.book.number, r.chapter, r.start_verse)] = \
+            " ".join(text.split())
+        books[r.book.number] = (r.book.name, r.book.section)
+    return verses, books
+
+
+def convert(lines, output, name, abbreviation, language="English"):
+    """ Converts a plain text translation into a local translation file.
+    Returns the number of verses converted.
+
+    :param lines: Lines of "reference<TAB>text"
+    :param output: The file to write
+    :param name: The full name of the translation
+    :param abbreviation: The translation abbreviation
+    :param language: The language of the translation
+    """
+
+    verses, books = read_source(lines)
+    sections = set(section for book, section in books.values())
+    header = json.dumps({
+        "name": name, "abbreviation": abbreviation.upper(),
+        "language": language,
+        "title": "%s (%s)" % (name, abbreviation.upper()),
+        "has_ot": "Old Testament" in sections,
+        "has_nt": "New Testament" in sections,
+        "has_deut": "Deuterocanon" in sections,
+        "books": dict((str(n), book) for n, (book, section)
+                      in books.items())}).encode("utf-8")
+
+    keys = array("I", sorted(verses))
+    offsets = array("I", [0])
+    text = bytearray()
+    for key in keys:
+        text += ("[**%d**] %s " % (key & 1023, verses[key])).encode("utf-8")
+        offsets.append(len(text))
+
+    if sys.byteorder != "little":
+        keys.byteswap()
+        offsets.byteswap()
+
+    temp_path = output + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, len(header), len(keys)))
+        f.write(header.ljust(padded(len(header)), b" "))
+        f.write(keys.tobytes())
+        f.write(offsets.tobytes())
+        f.write(text)
+    os.replace(temp_path, output)
+
+    return len(keys)
+
+
+# Translations read from LOCAL_TRANSLATIONS_PATH
+local_translations = LocalTranslations()
+
+
+def main():
+    arguments = argparse.ArgumentParser(
+        description="Converts a plain text translation to be served "
+                    "locally.")
+    arguments.add_argument("source", help="lines of reference<TAB>text")
+    arguments.add_argument("--abbreviation", required=True)
+    arguments.add_argument("--name", required=True)
+    arguments.add_argument("--language", default="English")
+    arguments.add_argument("--output", help="where to write the translation")
+    options = arguments.parse_args()
+
+    output = options.output or os.path.join(
+        LOCAL_TRANSLATIONS_PATH, options.abbreviation.lower() + EXTENSION)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(options.source, encoding="utf-8-sig") as f:
+        count = convert(f, output, options.name, options.abbreviation,
+                        options.language)
+    print("converted %d verses to %s" % (count, output))
+
+    local = LocalTranslation(output)
+    for book, chapter, number, text in local.verses():
+        quote_index.add(local.abbreviation, book, chapter, [(number, text)])
+    quote_index.flush()
+    print("added the verses to the quote index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+metrics.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import logging
+import os
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Address and port of the Prometheus text endpoint
+METRICS_ADDRESS = "127.0.0.1"
+METRICS_PORT = int(os.environ.get("VERSEBOT_METRICS_PORT", 9464))
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Registry:
+    """ The metrics exported on the endpoint. """
+
+    def __init__(self):
+        self.metrics = list()
+
+    def register(self, metric):
+        """ Adds a metric to the registry and returns it. """
+
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """ Returns every metric in the Prometheus text format. """
+
+        lines = list()
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.documentation))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class Metric:
+    """ A family of series sharing a name, told apart by label values. """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _format(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (name, escape(value))
+                                 for name, value in pairs)
+
+
+class Counter(Metric):
+    """ A count that only goes up. """
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """ Adds amount to the series with the given labels. """
+
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        """ Returns the count of the series with the given labels. """
+
+        return self._series.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return ["%s%s %s" % (self.name, self._format(key), value)
+                for key, value in series]
+
+
+class Gauge(Metric):
+    """ A value that can go up and down. """
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        """ Sets the series with the given labels to value. """
+
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def value(self, **labels):
+        """ Returns the value of the series with the given labels. """
+
+        return self._series.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return ["%s%s %s" % (self.name, self._format(key), value)
+                for key, value in series]
+
+
+class Histogram(Metric):
+    """ Observations counted into cumulative buckets, with their sum. """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """ Records an observation in the series with the given labels. """
+
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0,
+                                              0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observes the time (seconds) spent in a with block. """
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def count(self, **labels):
+        """ Returns the number of observations in a series. """
+
+        series = self._series.get(self._key(labels))
+        return series[2] if series is not None else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, (list(s[0]), s[1], s[2]))
+                            for key, s in self._series.items())
+
+        lines = list()
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append("%s_bucket%s %d" % (
+                    self.name, self._format(key, [("le", repr(bound))]),
+                    cumulative))
+            lines.append("%s_bucket%s %d" % (
+                self.name, self._format(key, [("le", "+Inf")]), count))
+            lines.append("%s_sum%s %r" % (self.name, self._format(key),
+                                          total))
+            lines.append("%s_count%s %d" % (self.name, self._format(key),
+                                            count))
+        return lines
+
+
+def escape(value):
+    """ Escapes a label value for the Prometheus text format. """
+
+    return (value.replace("\\", "\\\\").replace("\"", "\\\"")
+            .replace("\n", "\\n"))
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """ Serves the registry on /metrics. """
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=METRICS_PORT, address=METRICS_ADDRESS):
+    """ Serves the registry on a background thread. Returns the server, or
+    None if the port can't be bound.
+
+    :param port: The port to listen on, or 0 for any free port
+    :param address: The address to listen on
+    """
+
+    try:
+        server = ThreadingHTTPServer((address, port), MetricsHandler)
+    except OSError as e:
+        logging.getLogger("versebot").error(
+            "failed to start the metrics endpoint: " + str(e))
+        return None
+
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Registry holding every metric below
+registry = Registry()
+
+stage_seconds = registry.register(Histogram(
+    "versebot_stage_seconds",
+    "Time spent in each stage of handling a message.",
+    ["stage", "workspace", "translation"]))
+
+fetch_seconds = registry.register(Histogram(
+    "versebot_fetch_seconds", "Time spent fetching pages upstream.",
+    ["host", "translation"]))
+
+parse_seconds = registry.register(Histogram(
+    "versebot_parse_seconds", "Time spent parsing fetched pages.",
+    ["translation"]))
+
+messages_total = registry.register(Counter(
+    "versebot_messages_total", "RTM events received, by type.",
+    ["workspace", "type"]))
+
+responses_total = registry.register(Counter(
+    "versebot_responses_total", "Responses sent.",
+    ["workspace", "translation"]))
+
+fetch_errors_total = registry.register(Counter(
+    "versebot_fetch_errors_total", "Upstream fetches that failed.",
+    ["host", "translation"]))
+
+queue_depth = registry.register(Gauge(
+    "versebot_queue_depth", "Messages waiting in the work queue.",
+    ["workspace"]))
+
+queue_wait_seconds = registry.register(Histogram(
+    "versebot_queue_wait_seconds",
+    "Time messages waited in the work queue.", ["workspace"]))
+
+queue_dropped_total = registry.register(Counter(
+    "versebot_queue_dropped_total",
+    "Messages discarded because the work queue was full.", ["workspace"]))
+
+quote_searches_total = registry.register(Counter(
+    "versebot_quote_searches_total",
+    "Quoted-text searches, by where they were answered.", ["source"]))
@@ -0,0 +1,191 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+quoteindex.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import re
+import sqlite3
+
+from store import DATABASE_PATH, MAX_WRITE_BATCH, WriteBehindStore
+
+# Quotes with fewer words than this match too many verses to be answered
+# locally, and are left to BibleGateway's ranking
+MIN_QUERY_WORDS = 3
+
+VERSE_MARKER_REGEX = re.compile(r"\[\*\*(\d+)\*\*\]")
+HEADING_REGEX = re.compile(r"\n\n>\*\*.*?\*\*  \n")
+WORD_REGEX = re.compile(r"\w+")
+
+
+class QuoteIndex(WriteBehindStore):
+    """ Full-text index of the verses VerseBot has fetched, used to answer
+    quoted-text searches without BibleGateway. Searches are phrase queries
+    against an SQLite FTS5 table. If the index can't be opened (for instance
+    when SQLite is built without FTS5), every search misses. """
+
+    SCRIPT = "create_verse_index.sql"
+    NAME = "quote index"
+
+    def __init__(self, path=DATABASE_PATH):
+        """ Initializes a QuoteIndex. The passages already in the passage
+        store are indexed when the writer thread starts.
+
+        :param path: The database file
+        """
+
+        WriteBehindStore.__init__(self, path)
+
+    def search(self, text, translation):
+        """ Returns the reference (e.g. "John 3:16") of the best indexed
+        verse of a translation containing the words of text in order, or
+        None.
+
+        :param text: The quoted text to search for
+        :param translation: The translation abbreviation to search in
+        """
+
+        words = WORD_REGEX.findall(text)
+        if len(words) < MIN_QUERY_WORDS:
+            return None
+
+        connection = self._connection()
+        if connection is None:
+            return None
+
+        try:
+            row = connection.execute(
+                "SELECT book, chapter, verse FROM verse_text "
+                "JOIN verses ON verses.id = verse_text.rowid "
+                "WHERE verse_text MATCH ? AND verses.translation = ? "
+                "ORDER BY rank LIMIT 1",
+                ('"%s"' % " ".join(words), translation.upper())).fetchone()
+        except sqlite3.Error as e:
+            self.log.error("quote index search failed: " + str(e))
+            return None
+
+        if row is None:
+            return None
+        return "%s %d:%d" % row
+
+    def add(self, translation, book, chapter, verses):
+        """ Queues verses of a chapter to be indexed. Verses that are
+        already indexed are skipped.
+
+        :param translation: The translation abbreviation
+        :param book: The book name
+        :param chapter: The chapter number
+        :param verses: (verse number, text) pairs; the text may hold the
+            verse number markers and headings of message contents
+        """
+
+        rows = list()
+        for number, text in verses:
+            text = plain_text(text)
+            if text and number > 0:
+                rows.append((translation.upper(), book, chapter, number,
+                             text))
+        self.enqueue(rows)
+
+    def add_passage(self, verse, contents):
+        """ Queues the verses of fetched passage contents to be indexed.
+
+        :param verse: The verse the contents belong to
+        :param contents: The message contents of the passage
+        """
+
+        self.add(verse.translation, verse.book, verse.chapter,
+                 split_contents(contents, verse.start_verse))
+
+    def prepare(self, connection):
+        """ Indexes the passages already in the passage store.
+
+        :param connection: The writer thread's connection
+        """
+
+        index_passages(connection)
+
+    def write(self, connection, rows):
+        """ Indexes a batch of verses.
+
+        :param connection: The writer thread's connection
+        :param rows: (translation, book, chapter, verse, text) tuples
+        """
+
+        insert_verses(connection, rows)
+
+
+def insert_verses(connection, rows):
+    """ Adds verses that aren't indexed yet in one transaction.
+
+    :param connection: Connection to the index
+    :param rows: (translation, book, chapter, verse, text) tuples
+    """
+
+    with connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO verses "
+            "(translation, book, chapter, verse, text) "
+            "VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def index_passages(connection):
+    """ Indexes every passage in the passage store, if nothing has been
+    indexed yet.
+
+    :param connection: Connection to the index
+    """
+
+    if connection.execute("SELECT 1 FROM verses LIMIT 1").fetchone():
+        return
+    if not connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+            "AND name = 'passages'").fetchone():
+        return
+
+    rows = list()
+    for ref_key, contents in connection.execute(
+            "SELECT ref_key, contents FROM passages").fetchall():
+        translation, book, chapter, start_verse, end_verse = \
+            ref_key.split("|")
+        for number, text in split_contents(contents, int(start_verse)):
+            text = plain_text(text)
+            if text and number > 0:
+                rows.append((translation.upper(), book, int(chapter), number,
+                             text))
+        if len(rows) >= MAX_WRITE_BATCH:
+            insert_verses(connection, rows)
+            rows = list()
+    insert_verses(connection, rows)
+
+
+def split_contents(contents, start_verse):
+    """ Splits message contents at their verse number markers into (verse
+    number, text) pairs. Text before the first marker belongs to
+    start_verse.
+
+    :param contents: The message contents of a passage
+    :param start_verse: The number of the first verse of the passage
+    """
+
+    parts = VERSE_MARKER_REGEX.split(contents)
+    verses = [(start_verse, parts[0])]
+    for i in range(1, len(parts) - 1, 2):
+        verses.append((int(parts[i]), parts[i + 1]))
+    return verses
+
+
+def plain_text(text):
+    """ Strips the headings and verse number markers of message contents.
+
+    :param text: Message contents
+    """
+
+    text = HEADING_REGEX.sub(" ", text)
+    text = VERSE_MARKER_REGEX.sub("", text)
+    return " ".join(text.split())
+
+
+# Quote index in DATABASE_PATH, next to the passage store
+quote_index = QuoteIndex()
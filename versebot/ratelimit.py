@@ -0,0 +1,95 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+ratelimit.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import asyncio
+import time
+
+# Slack allows one message per second per channel, with short bursts
+CHANNEL_RATE = 1.0
+CHANNEL_BURST = 2
+
+# Upper bound on the messages sent to a whole workspace
+WORKSPACE_RATE = 5.0
+WORKSPACE_BURST = 10
+
+# Number of channel buckets kept before idle ones are dropped
+MAX_CHANNEL_BUCKETS = 1000
+
+
+class TokenBucket:
+    """ Token bucket that refills at rate tokens per second up to capacity.
+    Tokens are reserved rather than waited for, so concurrent callers are
+    served in the order they asked and the bucket may go into debt. """
+
+    def __init__(self, rate, capacity):
+        """ Initializes a full TokenBucket. """
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """ Takes a token from the bucket. Returns the time (seconds) the
+        caller has to wait before the token may be used. """
+
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def is_idle(self):
+        """ Returns true if the bucket has refilled completely, in which
+        case it can be dropped and recreated without changing behavior. """
+
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class SendLimiter:
+    """ Limits the messages sent to a workspace with one token bucket per
+    channel and one for the whole workspace. Only the sends that are over a
+    limit are delayed. """
+
+    def __init__(self, channel_rate=CHANNEL_RATE, channel_burst=CHANNEL_BURST,
+                 workspace_rate=WORKSPACE_RATE,
+                 workspace_burst=WORKSPACE_BURST):
+        """ Initializes a SendLimiter with no channel buckets. """
+
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.workspace = TokenBucket(workspace_rate, workspace_burst)
+        self.channels = dict()
+
+    async def acquire(self, channel):
+        """ Waits until a message may be sent to a channel.
+
+        :param channel: The channel the message is sent to
+        """
+
+        bucket = self.channels.get(channel)
+        if bucket is None:
+            if len(self.channels) >= MAX_CHANNEL_BUCKETS:
+                self._drop_idle_buckets()
+            bucket = TokenBucket(self.channel_rate, self.channel_burst)
+            self.channels[channel] = bucket
+
+        delay = max(bucket.reserve(), self.workspace.reserve())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _drop_idle_buckets(self):
+        for channel, bucket in list(self.channels.items()):
+            if bucket.is_idle():
+                del self.channels[channel]
@@ -7,6 +7,31 @@ Copyright (c) 2015 Matthieu Grieger (MIT License)
 """
 
 import re
+from collections import namedtuple
+from functools import lru_cache
+
+import books
+
+# Number of parsed quotations remembered by find_references
+REFERENCE_CACHE_SIZE = 4096
+
+VERSE_REGEX = re.compile(
+    r"(?<=\[)(?P<book>[\d\w\s]+)\s(?P<chapter>\d+)\:?(?P<verse>\d+"
+    r"\-?\d*)?\s*\(?(?P<translation>[\w\-\d]+)?\)?(?=\])")
+
+# Same quotations as VERSE_REGEX, with the verse range already split
+REFERENCE_REGEX = re.compile(
+    r"\[(?P<book>[\d\w\s]+)\s(?P<chapter>\d+)\:?(?:(?P<start_verse>\d+)"
+    r"(?:\-(?P<end_verse>\d*))?)?\s*\(?(?P<translation>[\w\-\d]+)?\)?"
+    r"(?=\])")
+
+# A parsed verse quotation. book is a books.BookReference, chapter,
+# start_verse and end_verse are integers, verse is the normalized verse
+# selection (None for a whole chapter) and translation is the upper case
+# abbreviation the user asked for (None if they didn't ask for one).
+Reference = namedtuple("Reference", ["book", "chapter", "verse",
+                                     "start_verse", "end_verse",
+                                     "translation"])
 
 
 def find_verses(message_body):
@@ -16,16 +41,112 @@ def find_verses(message_body):
     :param message_body: Body of message that possibly contains verse
         quotations
     """
-    regex = (r"(?<=\[)(?P<book>[\d\w\s]+)\s(?P<chapter>\d+)\:?(?P<verse>\d+"
-             r"\-?\d*)?\s*\(?(?P<translation>[\w\-\d]+)?\)?(?=\])")
 
-    matches = re.findall(regex, message_body)
+    matches = VERSE_REGEX.findall(message_body)
     if len(matches) == 0:
         return None
     else:
         return matches
 
 
+def find_references(message_body):
+    """ Scans a message body for verse quotations and parses each one into
+    a Reference in the same pass. Quotations of unrecognized books are
+    skipped. Returns a list of References if any are found, None otherwise.
+
+    :param message_body: Body of message that possibly contains verse
+        quotations
+    """
+
+    references = list()
+    for match in REFERENCE_REGEX.finditer(message_body):
+        reference = match_reference(match.groups())
+        if reference is not None:
+            references.append(reference)
+
+    if len(references) == 0:
+        return None
+    else:
+        return references
+
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def match_reference(groups):
+    """ Builds a Reference out of the groups of a REFERENCE_REGEX match.
+    References are immutable, so popular quotations are only parsed once.
+    Returns None if the book isn't recognized.
+
+    :param groups: The (book, chapter, start verse, end verse, translation)
+        groups of the match
+    """
+
+    book, chapter, start_verse, end_verse, translation = groups
+    book_reference = books.resolve_book(book)
+    if book_reference is None:
+        return None
+
+    return build_reference(book_reference, int(chapter), start_verse,
+                           end_verse, translation)
+
+
+def parse_reference(book, chapter, verse, translation):
+    """ Parses the parts of a verse quotation into a Reference. Returns
+    None if the book isn't recognized.
+
+    :param book: The book as the user wrote it
+    :param chapter: The chapter number
+    :param verse: The verse or verse range, empty or None for the whole
+        chapter
+    :param translation: The translation abbreviation, empty or None if
+        there isn't one
+    """
+
+    book_reference = books.resolve_book(book)
+    if book_reference is None:
+        return None
+
+    if verse:
+        start_verse, dash, end_verse = verse.replace(" ", "").partition("-")
+    else:
+        start_verse = end_verse = None
+    if translation:
+        translation = translation.replace(" ", "")
+
+    return build_reference(book_reference, int(chapter.replace(" ", "")),
+                           start_verse, end_verse, translation)
+
+
+def build_reference(book_reference, chapter, start_verse, end_verse,
+                    translation):
+    """ Builds a Reference out of the matched parts of a verse quotation. A
+    reversed verse range (e.g. 17-16) is treated as the whole chapter.
+
+    :param book_reference: The books.BookReference of the quoted book
+    :param chapter: The chapter number, as an integer
+    :param start_verse: The first verse, None or empty for the whole chapter
+    :param end_verse: The last verse, None or empty for a single verse
+    :param translation: The translation abbreviation, None or empty if there
+        isn't one
+    """
+
+    if start_verse:
+        start_verse = int(start_verse)
+        end_verse = int(end_verse) if end_verse else start_verse
+        if start_verse > end_verse:
+            verse = None
+        elif start_verse == end_verse:
+            verse = str(start_verse)
+        else:
+            verse = "%d-%d" % (start_verse, end_verse)
+    else:
+        verse = None
+        start_verse = 0
+        end_verse = 0
+
+    return Reference(book_reference, chapter, verse, start_verse, end_verse,
+                     translation.upper() if translation else None)
+
+
 def find_already_quoted_verses(message_body):
     """ Uses regex to search an existing VerseBot response for verse
     quotations. Used for removing invalid statistics from database.
@@ -6,8 +6,29 @@ response.py
 Copyright (c) 2015 Matthieu Grieger (MIT License)
 """
 
+import asyncio
+import logging
+
+import versification
+import webparser
+from quoteindex import VERSE_MARKER_REGEX
+
 MAXIMUM_MESSAGE_LENGTH = 4000
 
+# Most characters of verses sent in reply to one message, over however
+# many messages it takes. Verses past it are sent as links.
+MAXIMUM_RESPONSE_LENGTH = 4 * MAXIMUM_MESSAGE_LENGTH
+
+# Lower bound (characters) of the length of a verse in a response, verse
+# number included. Even the sparsest chapters (genealogies and lists)
+# average well above it, so a response whose verses add up to more than
+# the limit at this length is certain to overflow.
+MINIMUM_VERSE_LENGTH = 40
+
+# Typical length (characters) of a verse in a response, verse number
+# included, used to decide how many verses to fetch at a time
+AVERAGE_VERSE_LENGTH = 140
+
 
 class Response:
     """ Class that holds the properties and methods of a comment
@@ -47,23 +68,119 @@ class Response:
         return False
 
     def construct_message(self):
-        """ Constructs a message response. """
+        """ Constructs a message response. Verses are fetched one at a time,
+        and fetching stops as soon as the response is known to overflow.
+        """
+
+        if self.certain_overflow():
+            return self.overflow()
 
+        length = 0
         for verse in self.verse_list:
             verse.get_contents()
-            if verse.contents is not None:
-                if verse.verse is not None:
-                    self.response += ("[**%s %d:%s | %s**](%s)\n\n>"
-                                      % (verse.book, verse.chapter,
-                                         verse.verse, verse.translation_title,
-                                         verse.permalink))
+            length += len(format_verse(verse))
+            if length > MAXIMUM_MESSAGE_LENGTH:
+                return self.overflow()
+        return self.build_message()
+
+    async def send_progressively(self, send):
+        """ Sends the response as a series of messages, each no longer than
+        MAXIMUM_MESSAGE_LENGTH, starting as soon as the first verse is in.
+        The contents of the verses are fetched concurrently in waves of as
+        many verses as are expected to fit in the rest of the response, and
+        no more are fetched once it is full. Verses are sent in
+        the order in which they were added: each message holds the verses
+        that were ready in order when it was sent, and is sent as soon as
+        the next verse isn't ready yet or doesn't fit. Verses too long for
+        one message are split between verse numbers. Verses past
+        MAXIMUM_RESPONSE_LENGTH are sent as links instead, and so are the
+        verses from the first one that fails to be retrieved. Returns the
+        number of messages delivered.
+
+        :param send: Coroutine function that sends the text of a message,
+            and returns true if it was delivered
+        """
+
+        if self.certain_overflow(MAXIMUM_RESPONSE_LENGTH):
+            if await send(self.overflow(MAXIMUM_RESPONSE_LENGTH)):
+                return 1
+            return 0
+
+        futures = list()
+        message = ""
+        length = 0
+        sent = 0
+        try:
+            for i, verse in enumerate(self.verse_list):
+                if i == len(futures):
+                    wave = plan_wave(self.verse_list[i:], length)
+                    futures.extend(webparser.get_web_contents_futures(wave))
+
+                future = futures[i]
+                if message and not future.done():
+                    if await send(message):
+                        sent += 1
+                    message = ""
+
+                try:
+                    verse.contents, verse.translation_title, \
+                        verse.permalink = await future
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.getLogger("versebot").error(
+                        "failed to retrieve %s %d: %s" % (
+                            verse.book, verse.chapter, str(e)))
+                    overflow = self.generate_failure_response(
+                        self.verse_list[i:])
                 else:
-                    self.response += ("[**%s %d | %s**](%s)\n\n>"
-                                      % (verse.book, verse.chapter,
-                                         verse.translation_title,
-                                         verse.permalink))
-                self.response += verse.contents
-                self.response += "\n\n"
+                    parts = split_verse(verse)
+                    length += sum(len(part) for part in parts)
+                    overflow = None
+                    if length > MAXIMUM_RESPONSE_LENGTH:
+                        overflow = self.generate_overflow_response(
+                            self.verse_list[i:], MAXIMUM_RESPONSE_LENGTH)
+
+                if overflow is not None:
+                    if message and await send(message):
+                        sent += 1
+                    message = overflow
+                    break
+
+                for part in parts:
+                    if message and \
+                            len(message) + len(part) > MAXIMUM_MESSAGE_LENGTH:
+                        if await send(message):
+                            sent += 1
+                        message = ""
+                    message += part
+        finally:
+            release_futures(futures)
+
+        if message and await send(message):
+            sent += 1
+        return sent
+
+    def certain_overflow(self, limit=MAXIMUM_MESSAGE_LENGTH):
+        """ Returns true if the response can't fit in limit characters,
+        even if every verse that hasn't been fetched is as short as it can
+        be.
+
+        :param limit: The length (characters) the response must fit in
+        """
+
+        length = 0
+        for verse in self.verse_list:
+            length += estimate_length(verse, MINIMUM_VERSE_LENGTH)
+            if length > limit:
+                return True
+        return False
+
+    def build_message(self):
+        """ Builds the message response from verses whose contents have
+        already been retrieved. """
+
+        self.response = "".join(format_verse(v) for v in self.verse_list)
         if self.response == "":
             return None
         else:
@@ -72,25 +189,76 @@ class Response:
             # self.response += self.get_comment_footer()
             return self.response
 
+    def overflow(self, limit=MAXIMUM_MESSAGE_LENGTH):
+        """ Replaces the response with the overflow response, and returns
+        it.
+
+        :param limit: The length (characters) the response exceeds
+        """
+
+        self.response = self.generate_overflow_response(limit=limit)
+        return self.response
+
     def exceeds_max_length(self):
         """ Returns true if the current response exceeds the maximum comment
         length, returns false otherwise. """
 
         return len(self.response) > MAXIMUM_MESSAGE_LENGTH
 
-    def generate_overflow_response(self):
+    def generate_overflow_response(self, verses=None,
+                                   limit=MAXIMUM_MESSAGE_LENGTH):
         """ Constructs and generates an overflow comment whenever the comment
-        exceeds the character limit set by MAXIMUM_MESSAGE_LENGTH. Instead of
-        posting the contents of the verse(s) in the comment, it links to
-        webpages that contain the contents of the verse(s). """
+        exceeds the character limit. Instead of posting the contents of the
+        verse(s) in the comment, it links to webpages that contain the
+        contents of the verse(s).
 
-        comment = ("The contents of the verse(s) you quoted exceed the %d "
-                   "character limit. Instead, here are links to the "
-                   "verse(s)!\n\n" % MAXIMUM_MESSAGE_LENGTH)
+        :param verses: The verses to link to, every verse by default. If
+            the earlier verses have been sent, only the rest are linked to.
+        :param limit: The length (characters) the response exceeds
+        """
 
-        for verse in self.verse_list:
+        if verses is None:
+            verses = self.verse_list
+        if len(verses) < len(self.verse_list):
+            comment = ("The verse(s) you quoted exceed the %d character "
+                       "limit. Instead, here are links to the rest of "
+                       "them!\n\n" % limit)
+        else:
+            comment = ("The contents of the verse(s) you quoted exceed the "
+                       "%d character limit. Instead, here are links to the "
+                       "verse(s)!\n\n" % limit)
+
+        return comment + self.generate_links(verses)
+
+    def generate_failure_response(self, verses):
+        """ Constructs a comment linking to verses whose contents couldn't
+        be retrieved.
+
+        :param verses: The verses to link to. If the earlier verses have
+            been sent, only the rest are linked to.
+        """
+
+        if len(verses) < len(self.verse_list):
+            comment = ("The rest of the verse(s) you quoted couldn't be "
+                       "retrieved. Instead, here are links to them!\n\n")
+        else:
+            comment = ("The verse(s) you quoted couldn't be retrieved. "
+                       "Instead, here are links to the verse(s)!\n\n")
+
+        return comment + self.generate_links(verses)
+
+    def generate_links(self, verses):
+        """ Returns a list of links to webpages that contain the contents
+        of verses.
+
+        :param verses: The verses to link to
+        """
+
+        comment = ""
+        for verse in verses:
             if verse.translation == "JPS":
-                overflow_link = verse.permalink
+                overflow_link = (verse.permalink or
+                                 webparser.get_permalink(verse))
             else:
                 if verse.verse is not None:
                     overflow_link = ("https://www.biblegateway.com/passage/"
@@ -98,7 +266,8 @@ class Response:
                                      % (verse.book, verse.chapter, verse.verse,
                                         verse.translation))
                 else:
-                    overflow_link = verse.permalink
+                    overflow_link = (verse.permalink or
+                                     webparser.get_permalink(verse))
 
             if verse.verse is not None:
                 comment += ("- [%s %d:%s (%s)](%s)\n\n"
@@ -138,3 +307,131 @@ class Response:
                 % {"user": self.message.author, "bot": REDDIT_USERNAME,
                    "link": self.link})
     '''
+
+
+def format_verse(verse, contents=None, title=None, permalink=None):
+    """ Returns the part of a response that quotes a verse, or an empty
+    string if the verse has no contents. The contents, translation title
+    and permalink of the verse are used unless others are given.
+
+    :param verse: The verse to quote
+    :param contents: The contents to quote instead of the verse's
+    :param title: The translation title to use instead of the verse's
+    :param permalink: The permalink to use instead of the verse's
+    """
+
+    if contents is None:
+        contents = verse.contents
+    if contents is None:
+        return ""
+    if title is None:
+        title = verse.translation_title
+    if permalink is None:
+        permalink = verse.permalink
+
+    if verse.verse is not None:
+        header = ("[**%s %d:%s | %s**](%s)\n\n>"
+                  % (verse.book, verse.chapter, verse.verse, title,
+                     permalink))
+    else:
+        header = ("[**%s %d | %s**](%s)\n\n>"
+                  % (verse.book, verse.chapter, title, permalink))
+    return header + contents + "\n\n"
+
+
+def release_futures(futures):
+    """ Cancels the futures that haven't resolved, and retrieves the
+    exceptions of those that failed, so that none is logged as never
+    retrieved.
+
+    :param futures: Futures of verse contents
+    """
+
+    for future in futures:
+        if not future.done():
+            future.cancel()
+        elif not future.cancelled():
+            future.exception()
+
+
+def split_verse(verse):
+    """ Returns the parts of a response that quote a verse, each no longer
+    than MAXIMUM_MESSAGE_LENGTH. A verse that doesn't fit in one message is
+    split between verse numbers, and every part repeats its header. Returns
+    an empty list if the verse has no contents.
+
+    :param verse: The verse to quote, with its contents retrieved
+    """
+
+    text = format_verse(verse)
+    if text == "" or len(text) <= MAXIMUM_MESSAGE_LENGTH:
+        return [text] if text else []
+
+    room = MAXIMUM_MESSAGE_LENGTH - len(format_verse(verse, ""))
+    return [format_verse(verse, piece)
+            for piece in split_contents(verse.contents, room)]
+
+
+def split_contents(contents, length):
+    """ Splits message contents before verse numbers into pieces no longer
+    than length. A single verse longer than length is cut into pieces of
+    exactly length characters.
+
+    :param contents: The message contents of a passage
+    :param length: The length (characters) of the longest piece
+    """
+
+    boundaries = [m.start() for m in VERSE_MARKER_REGEX.finditer(contents)]
+    pieces = list()
+    start = 0
+    end = 0
+    for boundary in boundaries + [len(contents)]:
+        if boundary - start > length and end > start:
+            pieces.append(contents[start:end])
+            start = end
+        end = boundary
+    pieces.append(contents[start:])
+
+    return [piece[i:i + length] for piece in pieces
+            for i in range(0, len(piece), length)]
+
+
+def estimate_length(verse, verse_length):
+    """ Returns the length of the part of a response that quotes a verse.
+    The length is exact if the contents can be had without fetching them;
+    otherwise every verse is taken to be verse_length characters long, and
+    the translation title and permalink to be empty.
+
+    :param verse: The verse to estimate the length for
+    :param verse_length: The length (characters) of each verse that hasn't
+        been fetched
+    """
+
+    result = webparser.peek_web_contents(verse)
+    if result is not None:
+        if result[0] is None:
+            return 0
+        return len(format_verse(verse, *result))
+
+    if verse.verse is None:
+        count = versification.get_verse_count(verse.book, verse.chapter) or 1
+    else:
+        count = verse.end_verse - verse.start_verse + 1
+    return len(format_verse(verse, "", "", "")) + count * verse_length
+
+
+def plan_wave(verses, length):
+    """ Returns the verses at the start of a list that are expected to fit
+    in the rest of a response, and at least the first one.
+
+    :param verses: The verses still to be fetched, in response order
+    :param length: The length of the response so far
+    """
+
+    wave = list()
+    for verse in verses:
+        length += estimate_length(verse, AVERAGE_VERSE_LENGTH)
+        if wave and length > MAXIMUM_RESPONSE_LENGTH:
+            break
+        wave.append(verse)
+    return wave
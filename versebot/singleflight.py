@@ -0,0 +1,63 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+singleflight.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """ Coalesces concurrent calls for the same key. The first caller runs
+    the function; callers that arrive while it is running wait for it and
+    share its result, or its exception. Thread-safe, for use from the fetch
+    executor. """
+
+    def __init__(self):
+        """ Initializes a SingleFlight with no calls in flight. """
+
+        self.calls = 0
+        self.shared = 0
+        self._flights = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """ Returns function(*args), sharing one call between every
+        concurrent caller with the same key.
+
+        :param key: Hashable key identifying the call
+        :param function: The function to call
+        """
+
+        with self._lock:
+            self.calls += 1
+            future = self._flights.get(key)
+            if future is not None:
+                self.shared += 1
+                leader = False
+            else:
+                future = Future()
+                self._flights[key] = future
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def in_flight(self):
+        """ Returns the number of calls currently running. """
+
+        return len(self._flights)
@@ -0,0 +1,166 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+stats.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+
+from store import DATABASE_PATH, create_missing_tables
+
+# Time (seconds) between writes of the collected counts
+FLUSH_INTERVAL = 60
+
+# Stats tables, and the script in sql/ that creates each of them
+STATS_TABLES = (("book_stats", "create_book_table.sql"),
+                ("translation_stats", "create_translation_table.sql"),
+                ("subreddit_stats", "create_subreddit_table.sql"),
+                ("comment_count", "create_comment_count_table.sql"))
+
+
+class UsageStats:
+    """ Usage counts per book, translation, channel and workspace. Counting
+    only updates dictionaries in memory; a background thread adds the counts
+    to the stats tables in a single transaction every FLUSH_INTERVAL
+    seconds, so the timestamp trigger of a row fires once per flush rather
+    than once per message. Channels are counted in subreddit_stats as
+    "workspace/channel", next to a row for the whole workspace. """
+
+    def __init__(self, path=DATABASE_PATH, interval=FLUSH_INTERVAL):
+        """ Initializes a UsageStats with nothing counted. The flush thread
+        is started the first time something is recorded.
+
+        :param path: The database file to write the counts to
+        :param interval: Time (seconds) between flushes, or None to only
+            write the counts when flush() is called
+        """
+
+        self.path = path
+        self.interval = interval
+        self.log = logging.getLogger("versebot")
+        self._books = dict()
+        self._translations = dict()
+        self._channels = dict()
+        self._responses = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._flusher = None
+
+    def record(self, verses, workspace, channel):
+        """ Counts a response and the verses quoted in it.
+
+        :param verses: The verses quoted in the response
+        :param workspace: The workspace the response was sent to
+        :param channel: The channel the response was sent to
+        """
+
+        with self._lock:
+            for v in verses:
+                self._books[v.book] = self._books.get(v.book, 0) + 1
+                self._translations[v.translation] = \
+                    self._translations.get(v.translation, 0) + 1
+            for key in (workspace, workspace + "/" + channel):
+                self._channels[key] = self._channels.get(key, 0) + 1
+            self._responses += 1
+
+        if self._flusher is None and self.interval is not None:
+            self._start_flusher()
+
+    def flush(self):
+        """ Adds everything counted so far to the stats tables. Counts that
+        can't be written are kept for the next flush. """
+
+        with self._write_lock:
+            with self._lock:
+                counts = (self._books, self._translations, self._channels,
+                          self._responses)
+                self._books = dict()
+                self._translations = dict()
+                self._channels = dict()
+                self._responses = 0
+
+            if not any(counts):
+                return
+
+            try:
+                self._write(*counts)
+            except (sqlite3.Error, OSError) as e:
+                self.log.error("usage stats write failed: " + str(e))
+                self._restore(*counts)
+
+    def _write(self, books, translations, channels, responses):
+        connection = sqlite3.connect(self.path, timeout=10)
+        try:
+            create_missing_tables(connection, STATS_TABLES)
+            with connection:
+                for book, count in books.items():
+                    add_count(connection, "book_stats", "book", book, count)
+                for trans, count in translations.items():
+                    add_count(connection, "translation_stats", "trans",
+                              trans, count)
+                for channel, count in channels.items():
+                    add_count(connection, "subreddit_stats", "sub", channel,
+                              count)
+                if responses:
+                    connection.execute(
+                        "UPDATE comment_count SET t_count = t_count + ? "
+                        "WHERE id = (SELECT MIN(id) FROM comment_count)",
+                        (responses,))
+        finally:
+            connection.close()
+
+    def _restore(self, books, translations, channels, responses):
+        """ Adds counts that failed to be written back to the pending ones.
+        """
+
+        with self._lock:
+            for pending, counts in ((self._books, books),
+                                    (self._translations, translations),
+                                    (self._channels, channels)):
+                for key, count in counts.items():
+                    pending[key] = pending.get(key, 0) + count
+            self._responses += responses
+
+    def _start_flusher(self):
+        """ Starts the background flush thread if it isn't running. """
+
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_forever,
+                                                 daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+def add_count(connection, table, column, key, count):
+    """ Adds count to the row of a stats table whose column matches key,
+    inserting the row if there is none.
+
+    :param connection: Connection to the database, inside a transaction
+    :param table: The stats table
+    :param column: The column identifying a row
+    :param key: The value identifying the row
+    :param count: The number to add
+    """
+
+    cursor = connection.execute(
+        "UPDATE %s SET t_count = t_count + ? WHERE %s = ?" % (table, column),
+        (count, key))
+    if cursor.rowcount == 0:
+        connection.execute(
+            "INSERT INTO %s (%s, t_count, last_used) "
+            "VALUES (?, ?, datetime('now'))" % (table, column), (key, count))
+
+
+# Usage stats, flushed to DATABASE_PATH every FLUSH_INTERVAL seconds
+usage_stats = UsageStats()
@@ -0,0 +1,265 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+store.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+# Database file shared with the scripts in sql/
+DATABASE_PATH = "versebot_db.sqlite"
+
+# Directory holding the schema scripts
+SQL_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "sql")
+
+# Maximum number of rows written in one transaction
+MAX_WRITE_BATCH = 100
+
+# Age (days) after which a stored passage is fetched again
+PASSAGE_MAX_AGE = 30
+
+
+class WriteBehindStore:
+    """ SQLite database that is read on the calling thread and written by a
+    background thread, so that writing to it never delays a response. Each
+    thread opens its own connection, running the schema script, which puts
+    the database in WAL mode so reads don't wait for the writer. Queued rows
+    are committed in batches of up to MAX_WRITE_BATCH. If the database can't
+    be opened, reads find nothing and queued rows are dropped.
+
+    Subclasses set SCRIPT and NAME, and implement write(). """
+
+    # Schema script in sql/ run when a connection is opened
+    SCRIPT = None
+
+    # What the database holds, for log messages
+    NAME = None
+
+    def __init__(self, path):
+        """ Initializes a WriteBehindStore. The database is opened, and its
+        schema created, the first time the store is used.
+
+        :param path: The database file
+        """
+
+        self.path = path
+        self.log = logging.getLogger("versebot")
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._broken = False
+
+    def start(self):
+        """ Starts the background writer thread if it isn't running. Queueing
+        a row starts it too. """
+
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_behind,
+                                                daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def enqueue(self, rows):
+        """ Queues rows to be written.
+
+        :param rows: The rows to pass to write()
+        """
+
+        if self._broken:
+            return
+
+        self.start()
+        for row in rows:
+            self._queue.put(row)
+
+    def flush(self):
+        """ Blocks until every queued row has been written. """
+
+        if self._writer is not None:
+            self._queue.join()
+
+    def prepare(self, connection):
+        """ Runs on the writer thread before the first batch is written.
+
+        :param connection: The writer thread's connection
+        """
+
+        pass
+
+    def write(self, connection, rows):
+        """ Writes a batch of queued rows in one transaction.
+
+        :param connection: The writer thread's connection
+        :param rows: The rows to write
+        """
+
+        raise NotImplementedError
+
+    def _connection(self):
+        """ Returns this thread's connection to the database, opening it if
+        needed. Returns None if the database can't be used. """
+
+        if self._broken:
+            return None
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = open_database(self.path, self.SCRIPT)
+            except (sqlite3.Error, OSError) as e:
+                self.log.error("%s unavailable: %s" % (self.NAME, e))
+                self._broken = True
+                return None
+            self._local.connection = connection
+
+        return connection
+
+    def _write_behind(self):
+        """ Writes queued rows in batches until the process exits. """
+
+        connection = self._connection()
+        if connection is not None:
+            try:
+                self.prepare(connection)
+            except sqlite3.Error as e:
+                self.log.error("%s setup failed: %s" % (self.NAME, e))
+
+        while True:
+            rows = [self._queue.get()]
+            while len(rows) < MAX_WRITE_BATCH:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            connection = self._connection()
+            try:
+                if connection is not None:
+                    self.write(connection, rows)
+            except sqlite3.Error as e:
+                self.log.error("%s write failed: %s" % (self.NAME, e))
+            finally:
+                for row in rows:
+                    self._queue.task_done()
+
+
+class PassageStore(WriteBehindStore):
+    """ On-disk passage store. Passages are stored under the same keys as in
+    the passage cache (see cache.passage_key). """
+
+    SCRIPT = "create_passage_table.sql"
+    NAME = "passage store"
+
+    def __init__(self, path=DATABASE_PATH, max_age=PASSAGE_MAX_AGE):
+        """ Initializes a PassageStore.
+
+        :param path: The database file
+        :param max_age: Age (days) after which a passage is no longer used
+        """
+
+        WriteBehindStore.__init__(self, path)
+        self.max_age = max_age
+
+    def get(self, key):
+        """ Returns the (contents, translation title, permalink) tuple stored
+        under key, or None if there is no fresh entry.
+
+        :param key: The passage key to look up
+        """
+
+        connection = self._connection()
+        if connection is None:
+            return None
+
+        try:
+            row = connection.execute(
+                "SELECT contents, trans_title, permalink FROM passages "
+                "WHERE ref_key = ? AND fetched > datetime('now', ?)",
+                (ref_key(key), "-%d days" % self.max_age)).fetchone()
+        except sqlite3.Error as e:
+            self.log.error("passage store read failed: " + str(e))
+            return None
+
+        if row is None:
+            return None
+        return tuple(row)
+
+    def put(self, key, value):
+        """ Queues a passage to be written to the store.
+
+        :param key: The passage key to store the passage under
+        :param value: The (contents, translation title, permalink) tuple
+        """
+
+        self.enqueue([(ref_key(key),) + tuple(value)])
+
+    def write(self, connection, rows):
+        """ Writes a batch of passages.
+
+        :param connection: The writer thread's connection
+        :param rows: (ref_key, contents, translation title, permalink) tuples
+        """
+
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO passages "
+                "(ref_key, contents, trans_title, permalink) "
+                "VALUES (?, ?, ?, ?)", rows)
+
+
+def open_database(path, script):
+    """ Opens the database and runs a schema script on it. The scripts put
+    the database in WAL mode and create their tables if they don't exist.
+
+    :param path: The database file to open
+    :param script: The schema script in sql/
+    """
+
+    connection = sqlite3.connect(path, timeout=10)
+    with open(os.path.join(SQL_DIRECTORY, script)) as f:
+        connection.executescript(f.read())
+
+    return connection
+
+
+def create_missing_tables(connection, tables):
+    """ Creates the tables that don't exist yet from their scripts in sql/.
+    The scripts create their tables unconditionally, and some of them seed
+    the tables, so each is only run when its table is missing.
+
+    :param connection: Connection to the database
+    :param tables: (table, script) pairs
+    """
+
+    existing = set(row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"))
+    for table, script in tables:
+        if table not in existing:
+            with open(os.path.join(SQL_DIRECTORY, script)) as f:
+                connection.executescript(f.read())
+
+
+def ref_key(key):
+    """ Returns the ref_key column value of a passage key, e.g.
+    "ESV|John|3|16|16".
+
+    :param key: A (book, chapter, start verse, end verse, translation)
+        passage key
+    """
+
+    book, chapter, start_verse, end_verse, translation = key
+    return "%s|%s|%d|%d|%d" % (translation, book, chapter, start_verse,
+                               end_verse)
+
+
+# Passage store in DATABASE_PATH
+passage_store = PassageStore()
@@ -6,6 +6,17 @@ translation.py
 Copyright (c) 2015 Matthieu Grieger (MIT License)
 """
 
+# Coverage bits for the sections of the Bible a translation contains
+OLD_TESTAMENT = 1
+NEW_TESTAMENT = 2
+DEUTEROCANON = 4
+
+SECTION_BITS = {
+    "Old Testament": OLD_TESTAMENT,
+    "New Testament": NEW_TESTAMENT,
+    "Deuterocanon": DEUTEROCANON
+}
+
 
 class Translation:
     """ A Translation class that holds various properties regarding a
@@ -21,3 +32,16 @@ class Translation:
         self.has_ot = has_ot
         self.has_nt = has_nt
         self.has_deut = has_deut
+        self.sections = ((OLD_TESTAMENT if has_ot else 0) |
+                         (NEW_TESTAMENT if has_nt else 0) |
+                         (DEUTEROCANON if has_deut else 0))
+
+    def has_section(self, bible_section):
+        """ Returns true if the translation contains the given section of the
+        Bible, returns false otherwise.
+
+        :param bible_section: "Old Testament", "New Testament" or
+            "Deuterocanon"
+        """
+
+        return bool(self.sections & SECTION_BITS.get(bible_section, 0))
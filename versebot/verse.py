@@ -6,8 +6,11 @@ verse.py
 Copyright (c) 2015 Matthieu Grieger (MIT License)
 """
 
-import books
+import versification
 import webparser
+from catalog import translation_catalog
+from defaults import default_translations
+from regex import parse_reference
 
 
 class Verse:
@@ -17,44 +20,47 @@ class Verse:
         """ Initializes a Verse object with book, chapter, verse (if
         exists), and translation (if exists). """
 
-        self.book = book
+        self.set_reference(parse_reference(book, chapter, verse, translation),
+                           user, channel)
+
+    @classmethod
+    def from_reference(cls, reference, user, channel):
+        """ Creates a Verse object from an already parsed Reference.
+
+        :param reference: The Reference to create the verse from
+        :param user: The user that called VerseBot for a quotation
+        :param channel: The channel where the quotation is located
+        """
+
+        verse = cls.__new__(cls)
+        verse.set_reference(reference, user, channel)
+        return verse
+
+    def set_reference(self, reference, user, channel):
+        """ Initializes the properties of a Verse object from a parsed
+        Reference.
+
+        :param reference: The Reference to initialize the verse from
+        :param user: The user that called VerseBot for a quotation
+        :param channel: The channel where the quotation is located
+        """
+
+        self.book = reference.book.name
+        self.book_number = reference.book.number
+        self.bible_section = reference.book.section
         self.channel = channel.lower()
-        book_num = books.get_book_number(self.book)
-        if book_num <= 39:
-            self.bible_section = "Old Testament"
-        elif book_num <= 66:
-            self.bible_section = "New Testament"
-        else:
-            self.bible_section = "Deuterocanon"
-
-        self.chapter = int(chapter.replace(" ", ""))
-        if verse != "":
-            self.verse = verse.replace(" ", "")
-            if "-" in self.verse:
-                start_verse, end_verse = self.verse.split("-")
-                if end_verse != "" and int(start_verse) > int(end_verse):
-                    self.verse = None
-                elif end_verse == "" or int(start_verse) == int(end_verse):
-                    self.verse = start_verse
-                    end_verse = int(start_verse)
-                self.start_verse = int(start_verse)
-                self.end_verse = int(end_verse)
-            else:
-                self.start_verse = int(self.verse)
-                self.end_verse = self.start_verse
-        else:
-            self.verse = None
-            self.start_verse = 0
-            self.end_verse = 0
-        if translation != "":
-            trans = translation.upper().replace(" ", "")
-            self.translation = trans
-            '''
-            if database.is_valid_trans(trans, self.bible_section):
-                self.translation = trans
+
+        self.chapter = reference.chapter
+        self.verse = reference.verse
+        self.start_verse = reference.start_verse
+        self.end_verse = reference.end_verse
+        self.valid = self.check_versification()
+        if reference.translation is not None:
+            if translation_catalog.is_valid_trans(reference.translation,
+                                                  self.bible_section):
+                self.translation = reference.translation
             else:
                 self.determine_translation(user, channel)
-            '''
         else:
             self.determine_translation(user, channel)
 
@@ -62,6 +68,33 @@ class Verse:
         self.contents = ""
         self.permalink = ""
 
+    def check_versification(self):
+        """ Checks the chapter and verses against the versification table,
+        clamping an ending verse that runs past the end of the chapter.
+        Returns false if the reference can't exist in any translation, in
+        which case there is nothing to fetch. """
+
+        if self.verse is None:
+            bounds = versification.check_reference(self.book, self.chapter,
+                                                   0, 0)
+        elif self.start_verse < 1:
+            return False
+        else:
+            bounds = versification.check_reference(self.book, self.chapter,
+                                                   self.start_verse,
+                                                   self.end_verse)
+        if bounds is None:
+            return False
+
+        if self.verse is not None and bounds[1] != self.end_verse:
+            self.end_verse = bounds[1]
+            if self.start_verse == self.end_verse:
+                self.verse = str(self.start_verse)
+            else:
+                self.verse = "%d-%d" % (self.start_verse, self.end_verse)
+
+        return True
+
     def determine_translation(self, user, channel):
         """ Determines which translation should be used when either the user
         does not provide a translation, or when the user provides an invalid
@@ -70,18 +103,10 @@ class Verse:
         :param channel: The channel where the quotation is located
         :param user: The user that called VerseBot for a quotation
         """
-        '''
-        user_default = database.get_user_trans(user, self.bible_section)
-        if user_default:
-            self.translation = user_default
-        else:
-            channel_default = database.get_channel_trans(
-                channel, self.bible_section)
-            if channel_default:
-                self.translation = channel_default
-            else:
-        '''
-        if self.bible_section == "Old Testament":
+        default = default_translations.get(user, channel, self.bible_section)
+        if default is not None:
+            self.translation = default
+        elif self.bible_section == "Old Testament":
             self.translation = "ESV"
         elif self.bible_section == "New Testament":
             self.translation = "ESV"
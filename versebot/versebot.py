@@ -6,99 +6,205 @@ Copyright (c) 2016 Matt Arnold (MIT License)
 
 """
 import asyncio
+import functools
+import os
 import websockets
 import json
 import signal
 import logging
 import time
 import re
+from collections import OrderedDict
 from slacker import Slacker
 
-import sys
-import threading
-
-import books
+import metrics
 import webparser
-from regex import find_verses
+from defaults import default_translations
+from ratelimit import SendLimiter
+from regex import find_references
 from response import Response
+from stats import usage_stats
 from verse import Verse
 from webparser import WebParser
+from workqueue import WorkQueue
 
 # Time (seconds) to wait between receiving message before sending a ping
 TIMEOUT = 3
 
+# Translation quoted text is searched in
+SEARCH_TRANSLATION = 'ESV'
+
+# Time (seconds) a reply waits for the bot to reconnect before it is dropped
+SEND_TIMEOUT = 30
+
+# Time (seconds) after sending a reply during which it is sent again on the
+# next connection if Slack hasn't acknowledged it. Older replies are
+# dropped, since Slack has most likely posted them already.
+RESEND_TIMEOUT = 10
+
+# File holding one Slack token per line
+TOKENS_PATH = 'tokens.dat'
 
-class VerseBot(threading.Thread):
-    def __init__(self, token):
-        super(VerseBot, self).__init__()
+# Time (seconds) between checks of the tokens file for added or removed
+# tokens
+TOKENS_RELOAD_INTERVAL = 30
 
-        logging.getLogger('requests').setLevel(logging.WARNING)
+# Time (seconds) before restarting a bot that stopped, doubled after every
+# stop in a row up to RESTART_MAX_DELAY. A bot that ran for longer than
+# RESTART_MAX_DELAY is restarted after RESTART_DELAY again.
+RESTART_DELAY = 5
+RESTART_MAX_DELAY = 300
 
+
+class VerseBot:
+    def __init__(self, token, slack=None):
         self.log = logging.getLogger('versebot')
-        self.log.addHandler(logging.FileHandler('versebot_log.txt'))
         self.parser = WebParser()
-        self.slack = Slacker(token)
+        self.slack = slack or Slacker(token)
         self.next_id = 1
-        self.unacked_messages = set()
-        self.user_id = self._get_user_id()
-
-    def _get_user_id(self):
-        data = self.slack.auth.test()
+        self.unacked_messages = OrderedDict()
+        self.limiter = SendLimiter()
+        self.work_queue = None
+        self.user_id = None
+        self.workspace = 'unknown'
+        self.websocket = None
+        self._connected = None
+
+    async def _get_user_id(self):
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, self.slack.auth.test)
 
         if data.successful:
+            self.workspace = data.body.get('team_id', self.workspace)
             return data.body['user_id']
         else:
             raise Exception
 
-    async def connect(self):
-        rtm_response = self.slack.rtm.start()
+    async def _start_rtm(self):
+        loop = asyncio.get_event_loop()
+        rtm_response = await loop.run_in_executor(None, self.slack.rtm.start)
 
         if rtm_response.successful:
-            url = rtm_response.body['url']
-
-            while True:
-                try:
-                    await self.listen(url)
-                except websockets.ConnectionClosed:
-                    pass
-                except Exception as e:
-                    self.log.error('caught ' + str(type(e)) + ':' + str(e))
-                    pass
-
+            return rtm_response.body['url']
         else:
             self.log.error('Failed to connect to rtm')
+            return None
 
-    def run(self):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-        asyncio.ensure_future(self.connect())
-        loop.run_forever()
+    async def connect(self):
+        """ Connects to Slack and answers messages until the bot fails to
+        reconnect. RTM urls expire, so every connection starts a new RTM
+        session. Errors starting a session or connecting end the bot, and
+        are left to VerseBotRunner, which restarts it after a delay. """
+
+        self.user_id = await self._get_user_id()
+        url = await self._start_rtm()
+
+        if url is not None:
+            self.work_queue = WorkQueue(self._handle_message,
+                                        workspace=self.workspace)
+            self.work_queue.start()
+            try:
+                while url is not None:
+                    try:
+                        await self.listen(url)
+                    except websockets.ConnectionClosed:
+                        pass
+                    url = await self._start_rtm()
+            finally:
+                self.work_queue.stop()
 
     async def listen(self, url):
         async with websockets.connect(url) as websocket:
-            while True:
-                try:
-                    msg = await asyncio.wait_for(websocket.recv(), TIMEOUT)
+            self.set_connection(websocket)
+            try:
+                await self.resend_unacked(websocket)
+                await self._receive(websocket)
+            finally:
+                self.set_connection(None)
+
+    def set_connection(self, websocket):
+        """ Sets the connection replies are sent on. Queued messages are
+        answered on whichever connection is current when the reply is
+        sent, so replies survive a reconnect.
+
+        :param websocket: The open RTM websocket, or None while the bot is
+            reconnecting
+        """
+
+        if self._connected is None:
+            self._connected = asyncio.Event()
+        self.websocket = websocket
+        if websocket is None:
+            self._connected.clear()
+        else:
+            self._connected.set()
+
+    async def resend_unacked(self, websocket):
+        """ Sends again the messages Slack hasn't acknowledged that were
+        sent in the last RESEND_TIMEOUT seconds, since they may have been
+        lost with the previous connection. Older ones are dropped. If this
+        connection is already closed, the messages wait for the next one,
+        and what was received on it is still read. """
+
+        expired = time.monotonic() - RESEND_TIMEOUT
+        for message_id, (sent, data) in list(self.unacked_messages.items()):
+            if sent < expired:
+                del self.unacked_messages[message_id]
+                self.log.error('dropped unacknowledged reply to %s'
+                               % data['channel'])
+
+        try:
+            for sent, data in list(self.unacked_messages.values()):
+                await websocket.send(json.dumps(data))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _receive(self, websocket):
+        closing = None
+        while True:
+            timeout = TIMEOUT
+            if closing is not None:
+                timeout = closing - time.monotonic()
+                if timeout <= 0 or not self.unacked_messages:
+                    return
+            try:
+                msg = await asyncio.wait_for(websocket.recv(), timeout)
+                with metrics.stage_seconds.time(
+                        stage='json_decode', workspace=self.workspace):
                     msg = json.loads(msg)
+                metrics.messages_total.inc(workspace=self.workspace,
+                                           type=msg.get('type', ''))
 
-                    if msg.get('type', '') == 'message' and \
-                                    msg.get('subtype', '') != 'bot_message':
-                        if msg.get('text', '').find('@' + self.user_id) != -1:
-                            await self.send_verses_response(msg, websocket)
-                            time.sleep(1)
-                    elif msg.get('type', '') == 'error':
-                        self.log.error(
-                            'error message received: %s' % (json.dumps(msg)))
-                        return
-
-                    # TODO handle rtm response. check if ok
-                    else:
-                        pass
-                except asyncio.TimeoutError:
+                if msg.get('type', '') == 'pong':
+                    pass
+                elif 'reply_to' in msg:
+                    self.unacked_messages.pop(msg['reply_to'], None)
+                elif msg.get('type', '') == 'message' and \
+                                msg.get('subtype', '') != 'bot_message':
+                    if msg.get('text', '').find('@' + self.user_id) != -1:
+                        await self.work_queue.put(msg)
+                elif msg.get('type', '') == 'error':
+                    self.log.error(
+                        'error message received: %s' % (json.dumps(msg)))
+                    # New replies wait for the next connection. This one is
+                    # read for up to TIMEOUT seconds more, until Slack has
+                    # acknowledged the replies sent on it, so that they
+                    # aren't sent again.
+                    if closing is None:
+                        self.set_connection(None)
+                        closing = time.monotonic() + TIMEOUT
+
+                # TODO handle rtm response. check if ok
+                else:
+                    pass
+            except asyncio.TimeoutError:
+                if closing is None:
                     await self.ping(websocket)
 
-    async def send_verses_response(self, msg, websocket):
+    async def _handle_message(self, msg):
+        await self.send_verses_response(msg)
+
+    async def send_verses_response(self, msg):
         user = msg['user']
         channel = msg['channel']
         body = msg['text']
@@ -106,75 +212,272 @@ class VerseBot(threading.Thread):
         match = re.search(r'["“].*"', body)
 
         if match is not None:
-            reference = self.search(match.group(0))
+            with metrics.stage_seconds.time(stage='quote_search',
+                                            workspace=self.workspace,
+                                            translation=SEARCH_TRANSLATION):
+                reference = await self.search(match.group(0))
             if reference is None:
                 pass
             else:
                 body = '[' + reference + ']'
 
-        verses = find_verses(body)
-        await self.send_verses(body, verses, user, channel, websocket)
+        with metrics.stage_seconds.time(stage='find_references',
+                                        workspace=self.workspace):
+            references = find_references(body)
+        await self.send_verses(body, references, user, channel)
 
     async def ping(self, websocket):
+        """ Sends a ping. The pong is read by _receive with every other
+        message, so no acknowledgement or mention is missed. """
+
         ping_message = json.dumps({"id": self.next_id, "type": "ping",
                                    "time": time.time()})
         self.next_id += 1
         await websocket.send(ping_message)
-        pong = await websocket.recv()
-        # eventually validate or something here
 
-    async def send_message(self, text, channel, websocket):
-        data = {'id': self.next_id, 'type': 'message', 'channel': channel,
-                'text': text}
+    async def send_message(self, text, channel, translation=''):
+        """ Sends a message on the current connection. If the bot is
+        reconnecting, or the connection closes while sending, the message
+        waits up to SEND_TIMEOUT seconds for the next connection. Returns
+        true if the message was sent.
 
-        self.next_id += 1
-        self.unacked_messages.add(self.next_id)
+        :param text: The text of the message
+        :param channel: The channel to send the message to
+        :param translation: The translations quoted in the message, for
+            the metrics
+        """
+
+        with metrics.stage_seconds.time(stage='send',
+                                        workspace=self.workspace,
+                                        translation=translation):
+            await self.limiter.acquire(channel)
+
+            data = {'id': self.next_id, 'type': 'message',
+                    'channel': channel, 'text': text}
 
-        await websocket.send(json.dumps(data))
+            self.next_id += 1
 
-    async def send_verses(self, body, verses, user, channel, websocket):
-        if verses is not None:
+            deadline = time.monotonic() + SEND_TIMEOUT
+            while True:
+                websocket = await self._wait_for_connection(
+                    deadline - time.monotonic())
+                if websocket is None:
+                    self.log.error('dropped a reply to %s: not connected'
+                                   % channel)
+                    return False
+                # Slack may acknowledge the message before send returns
+                self.unacked_messages[data['id']] = (time.monotonic(), data)
+                try:
+                    await websocket.send(json.dumps(data))
+                    break
+                except websockets.ConnectionClosed:
+                    self.unacked_messages.pop(data['id'], None)
+                    if self.websocket is websocket:
+                        self.set_connection(None)
+        metrics.responses_total.inc(workspace=self.workspace,
+                                    translation=translation)
+        return True
+
+    async def _wait_for_connection(self, timeout):
+        """ Returns the current connection, waiting up to timeout seconds
+        for one. Returns None if there is none by then. """
+
+        if self._connected is None:
+            self._connected = asyncio.Event()
+        deadline = time.monotonic() + timeout
+        while self.websocket is None and time.monotonic() < deadline:
+            # The connection may close again before the waiter runs
+            try:
+                await asyncio.wait_for(self._connected.wait(),
+                                       deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+        return self.websocket
+
+    async def send_verses(self, body, references, user, channel):
+        if references is not None:
             response = Response(body, self.parser)
-            for verse in verses:
-                book_name = books.get_book(verse[0])
-                if book_name is not None:
-                    v = Verse(book_name,
-                              verse[1],
-                              verse[3],
-                              user,
-                              channel,
-                              verse[2])
-                    if not response.is_duplicate_verse(v):
-                        response.add_verse(v)
+            start = time.monotonic()
+            for reference in references:
+                v = Verse.from_reference(reference, user, channel)
+                if v.valid and not response.is_duplicate_verse(v):
+                    response.add_verse(v)
+            translation = translation_label(response.verse_list)
+            metrics.stage_seconds.observe(
+                time.monotonic() - start, stage='resolve_verses',
+                workspace=self.workspace, translation=translation)
+
             if len(response.verse_list) != 0:
-                message_response = response.construct_message()
-                if message_response is not None:
-                    await self.send_message(message_response, channel,
-                                            websocket)
+                async def send(text):
+                    return await self.send_message(text, channel,
+                                                   translation)
+
+                with metrics.stage_seconds.time(stage='respond',
+                                                workspace=self.workspace,
+                                                translation=translation):
+                    sent = await response.send_progressively(send)
+                if sent:
+                    usage_stats.record(response.verse_list, self.workspace,
+                                       channel)
         else:
             pass
 
-    def search(self, search_terms):
-        return webparser.search_bible_gateway(search_terms)
+    async def search(self, search_terms):
+        return await webparser.search_bible_gateway_async(
+            search_terms, SEARCH_TRANSLATION)
 
 
-def handle_sigint(sig, frame):
-    for thread in threads:
-        signal.pthread_kill(thread.ident, signal.SIGINT)
+def translation_label(verses):
+    """ Returns the translations of verses as a metrics label, e.g.
+    "ESV,KJV".
 
-    sys.exit(0)
+    :param verses: The verses of a response
+    """
 
+    return ','.join(sorted(set(v.translation for v in verses)))
 
-threads = []
-if __name__ == '__main__':
-    signal.signal(signal.SIGINT, handle_sigint)
 
-    with open('tokens.dat') as tokens:
-        for token in tokens.readlines():
-            token = token.strip()
-            vb = VerseBot(token)
-            vb.start()
-            threads.append(vb)
+class VerseBotRunner:
+    """ Runs a VerseBot for every token in the tokens file as a task on a
+    single event loop. All of them share the module-level singletons: the
+    passage and chapter caches, the passage store, the quote index, the
+    translation catalog, the local translations, the default translations,
+    the usage stats, the metrics registry, the HTTP client and the fetch
+    executor. Tokens added to or removed from the file are picked up while
+    the runner is running, and SIGHUP reloads both the tokens and the
+    default translations. A bot that fails to connect or stops is restarted
+    with exponential backoff. """
+
+    def __init__(self, tokens_path=TOKENS_PATH, loop=None):
+        """ Initializes a VerseBotRunner with no running bots. """
+
+        self.tokens_path = tokens_path
+        self.loop = loop or asyncio.get_event_loop()
+        self.log = logging.getLogger('versebot')
+        self.bots = dict()
+        self.restarts = dict()
+        self._failures = dict()
+        self._started = dict()
+        self._tokens_mtime = None
+
+    def add_token(self, token):
+        """ Starts a VerseBot for a token, unless one is already running.
+
+        :param token: The Slack token of the workspace
+        """
+
+        if token in self.bots or token in self.restarts:
+            return
+
+        bot = VerseBot(token)
+        task = asyncio.ensure_future(bot.connect(), loop=self.loop)
+        self._started[token] = self.loop.time()
+        task.add_done_callback(functools.partial(self._bot_done, token))
+        self.bots[token] = (bot, task)
+
+    def remove_token(self, token):
+        """ Stops the VerseBot running for a token.
+
+        :param token: The Slack token of the workspace
+        """
+
+        bot, task = self.bots.pop(token, (None, None))
+        if task is not None:
+            task.cancel()
+        restart = self.restarts.pop(token, None)
+        if restart is not None:
+            restart.cancel()
+        self._failures.pop(token, None)
+
+    def reload_tokens(self):
+        """ Starts a VerseBot for every new token in the tokens file, and
+        stops the ones whose tokens were removed from it. """
+
+        try:
+            with open(self.tokens_path) as tokens:
+                wanted = set(t.strip() for t in tokens.readlines())
+        except OSError as e:
+            self.log.error('failed to read tokens: ' + str(e))
+            return
+        wanted.discard('')
+
+        for token in list(self.bots) + list(self.restarts):
+            if token not in wanted:
+                self.remove_token(token)
+        for token in wanted:
+            self.add_token(token)
+
+    def reload(self):
+        """ Reloads the tokens file, and the default translations in the
+        background. """
+
+        self.reload_tokens()
+        self.loop.run_in_executor(None, default_translations.load)
+
+    async def watch_tokens(self):
+        """ Reloads the tokens file whenever it changes. """
+
+        while True:
+            try:
+                mtime = os.path.getmtime(self.tokens_path)
+            except OSError:
+                mtime = None
+            if mtime != self._tokens_mtime:
+                self._tokens_mtime = mtime
+                self.reload_tokens()
+            await asyncio.sleep(TOKENS_RELOAD_INTERVAL)
+
+    def run(self):
+        """ Starts every bot and the metrics endpoint, loads the default
+        translations, starts indexing quotes, and runs the event loop until
+        interrupted. """
+
+        metrics.start_server()
+        default_translations.load()
+        webparser.quote_index.start()
+        asyncio.ensure_future(self.watch_tokens(), loop=self.loop)
+        if hasattr(signal, 'SIGHUP'):
+            self.loop.add_signal_handler(signal.SIGHUP, self.reload)
+
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def _bot_done(self, token, task):
+        """ Logs bots that stopped because of an error, and schedules a
+        restart of every bot that stopped without being removed or
+        cancelled. """
+
+        if self.bots.get(token, (None, None))[1] is not task:
+            return
+        del self.bots[token]
+
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            e = task.exception()
+            self.log.error('bot stopped: ' + str(type(e)) + ':' + str(e))
+
+        if self.loop.time() - self._started[token] > RESTART_MAX_DELAY:
+            self._failures[token] = 0
+        failures = self._failures.get(token, 0)
+        self._failures[token] = failures + 1
+        delay = min(RESTART_DELAY * 2 ** failures, RESTART_MAX_DELAY)
+        self.log.error('restarting bot in %d seconds' % delay)
+        self.restarts[token] = self.loop.call_later(delay, self._restart,
+                                                    token)
+
+    def _restart(self, token):
+        """ Starts the bot of a token again after a restart delay. """
+
+        del self.restarts[token]
+        self.add_token(token)
+
+
+if __name__ == '__main__':
+    logging.getLogger('requests').setLevel(logging.WARNING)
+    logging.getLogger('versebot').addHandler(
+        logging.FileHandler('versebot_log.txt'))
 
-    for t in threads:
-        t.join()
+    VerseBotRunner().run()
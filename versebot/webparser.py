@@ -7,30 +7,98 @@ Copyright (c) 2015 Matthieu Grieger (MIT License)
 Portions copyright (c) 2016 Matt Arnold (MIT License)
 """
 
+import asyncio
+import os
 import re
-import requests
-from urllib.request import urlopen
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from warnings import filterwarnings
 
-from bs4 import BeautifulSoup
-
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+from cache import chapter_cache, chapter_key, passage_cache, passage_key
+from catalog import translation_catalog
+from httpclient import http_client
+from localtranslation import local_translations
+from metrics import (fetch_errors_total, fetch_seconds, parse_seconds,
+                     quote_searches_total)
+from quoteindex import quote_index
+from regex import find_references
+from singleflight import SingleFlight
+from store import passage_store
 from translation import Translation
 
 filterwarnings("ignore", category=DeprecationWarning)
 
+# Sites pages are fetched from. They can be pointed at a local server
+# (see benchmarks/stubserver.py) through the environment.
+BIBLE_GATEWAY_URL = os.environ.get("VERSEBOT_BIBLE_GATEWAY_URL",
+                                   "https://www.biblegateway.com")
+BIBLE_HUB_URL = os.environ.get("VERSEBOT_BIBLE_HUB_URL",
+                               "http://biblehub.com")
+
+# Maximum number of blocking page fetches that may run at the same time
+MAX_FETCH_WORKERS = 16
+
+# Maximum number of references combined into one BibleGateway request
+MAX_BATCH_REFERENCES = 10
+
+fetch_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS)
+
+# lxml builds the same trees as html.parser for passage pages, several
+# times faster, but it is optional
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Only the parts of a passage page that are read are parsed into a tree
+BIBLE_GATEWAY_STRAINER = SoupStrainer(
+    attrs={"class": ["passage-text", "passage-display-version"]})
+BIBLE_HUB_STRAINER = SoupStrainer(attrs={"class": ["chap", "vheading"]})
+QUICKSEARCH_STRAINER = SoupStrainer("article")
+
+SPAN_NUMBER_REGEX = re.compile(r"-(\d+)$")
+VERSE_NUMBER_REGEX = re.compile(r"(\d+)")
+FOOTNOTE_REGEX = re.compile(r"\[\w\]")
+
+# Upstream calls in flight, shared by concurrent requests for the same
+# passage, chapter or search
+flights = SingleFlight()
+
 
 class WebParser:
     """ WebParser class for BibleGateway parsing methods. """
 
     def __init__(self):
-        """ Initializes translations attribute and checks if there are any new
-        translations to add to the database. """
+        """ Starts the shared translation catalog if it isn't running yet,
+        and adds the translations served locally to it. The catalog is
+        loaded from its local snapshot and kept up to date in the
+        background, so this never waits on BibleGateway. """
+
+        translation_catalog.start(find_supported_translations)
+        translation_catalog.add_local(local_translations.translations())
+
+    @property
+    def translations(self):
+        """ The supported translations, longest abbreviation first. """
 
-        self.translations = find_supported_translations()
-        self.translations.sort(key=lambda t: len(t.abbreviation), reverse=True)
+        return translation_catalog.translations
 
 
 def get_web_contents(verse):
+    """ Returns the contents of a verse from the passage cache or the
+    passage store, or grabs them with fetch_web_contents and stores them.
+
+    :param verse: The verse to grab the contents for
+    """
+
+    return get_web_contents_batch([verse])[0]
+
+
+def fetch_web_contents(verse):
     """ Determines which web service to use based on the input
     translation, then calls the appropriate function to grab the contents
     of the verse.
@@ -44,23 +112,276 @@ def get_web_contents(verse):
         return get_bible_gateway_verse(verse)
 
 
+def get_web_contents_batch(verses):
+    """ Retrieves the contents of several verses that share a translation.
+    Verses are served from a local translation or the passage cache, sliced
+    out of a cached chapter, or read from the passage store. The remaining
+    ranged BibleGateway verses are fetched together in one request;
+    anything else is fetched one verse at a time. Fetched contents are
+    written to the cache and, in the background, to the store. Returns a
+    list of (contents, translation title, permalink) tuples in the same
+    order as the input verses.
+
+    :param verses: The verses to grab the contents for
+    """
+
+    results = [get_memory_contents(v) for v in verses]
+    misses = [i for i, result in enumerate(results) if result is None]
+    for i, result in zip(misses,
+                         retrieve_contents_batch([verses[i] for i in misses])):
+        results[i] = result
+
+    return results
+
+
+def retrieve_contents_batch(verses):
+    """ The part of get_web_contents_batch that may block: verses are read
+    from the passage store, or fetched. Returns a list of (contents,
+    translation title, permalink) tuples in the same order as the input
+    verses.
+
+    :param verses: The verses to grab the contents for, none of them in
+        memory
+    """
+
+    results = [None] * len(verses)
+    for i, verse in enumerate(verses):
+        results[i] = passage_store.get(passage_key(verse))
+        if results[i] is not None:
+            passage_cache.put(passage_key(verse), results[i])
+
+    misses = [i for i, result in enumerate(results) if result is None]
+    ranged = [i for i in misses
+              if verses[i].translation != "JPS" and
+              verses[i].verse is not None]
+
+    fetched = dict()
+    if len(ranged) > 1:
+        fetched.update(zip(ranged, flights.do(
+            ("passages",) + tuple(passage_key(verses[i]) for i in ranged),
+            get_bible_gateway_verses, [verses[i] for i in ranged])))
+
+    for i in misses:
+        if i in fetched:
+            results[i] = fetched[i]
+        else:
+            results[i] = flights.do(("passage",) + passage_key(verses[i]),
+                                    fetch_web_contents, verses[i])
+        if results[i][0] is not None:
+            passage_cache.put(passage_key(verses[i]), results[i])
+            passage_store.put(passage_key(verses[i]), results[i])
+            quote_index.add_passage(verses[i], results[i][0])
+
+    return results
+
+
+def get_memory_contents(verse):
+    """ Returns the contents of a verse if they are in memory, from a local
+    translation, the passage cache or a cached chapter, or None otherwise.
+    Never blocks on I/O.
+
+    :param verse: The verse to get the contents for
+    """
+
+    result = get_local_contents(verse) or passage_cache.get(
+        passage_key(verse))
+    if result is None:
+        chapter = chapter_cache.get(chapter_key(verse))
+        if chapter is not None:
+            result = slice_chapter(chapter, verse)
+    return result
+
+
+def get_local_contents(verse):
+    """ Returns the contents of a verse from a translation served locally,
+    as a (contents, translation title, permalink) tuple, or None if its
+    translation isn't served locally or the local file lacks the verse, so
+    that the verse is looked up on the web instead.
+
+    :param verse: The verse to get the contents for
+    """
+
+    local = local_translations.get(verse.translation)
+    if local is None:
+        return None
+
+    contents = local.get_contents(verse)
+    if contents is None:
+        return None
+    return contents, local.title, bible_gateway_permalink(verse)
+
+
+def peek_web_contents(verse):
+    """ Returns the contents of a verse if they can be had without fetching
+    or reading from disk, from a local translation, the passage cache or a
+    cached chapter, or None otherwise. Lookups aren't counted as cache hits
+    or misses.
+
+    :param verse: The verse to look up
+    """
+
+    result = get_local_contents(verse) or passage_cache.peek(
+        passage_key(verse))
+    if result is None:
+        chapter = chapter_cache.peek(chapter_key(verse))
+        if chapter is not None:
+            result = slice_chapter(chapter, verse)
+    return result
+
+
+def get_permalink(verse):
+    """ Returns the link to the chapter of a verse without fetching it.
+
+    :param verse: The verse to build the link for
+    """
+
+    if verse.translation == "JPS":
+        return bible_hub_url(verse)
+    return bible_gateway_permalink(verse)
+
+
+def get_chapter(verse):
+    """ Returns the parsed chapter a verse belongs to from the chapter
+    cache, or fetches and caches it. Returns None if the chapter can't be
+    found.
+
+    :param verse: The verse to grab the chapter for
+    """
+
+    key = chapter_key(verse)
+    chapter = chapter_cache.get(key)
+    if chapter is None:
+        chapter = flights.do(("chapter",) + key, fetch_chapter, verse)
+
+    return chapter
+
+
+def fetch_chapter(verse):
+    """ Fetches, parses and caches the chapter a verse belongs to. Returns
+    None if the chapter can't be found.
+
+    :param verse: The verse to grab the chapter for
+    """
+
+    if verse.translation == "JPS":
+        chapter = get_bible_hub_chapter(verse)
+    else:
+        chapter = get_bible_gateway_chapter(verse)
+    if chapter is not None:
+        chapter_cache.put(chapter_key(verse), chapter)
+        quote_index.add(verse.translation, verse.book, verse.chapter,
+                        chapter[0])
+
+    return chapter
+
+
+def slice_chapter(chapter, verse):
+    """ Builds the contents of a verse out of a parsed chapter without
+    fetching or parsing anything. Returns a (contents, translation title,
+    permalink) tuple, or (None, None, None) if the chapter holds none of the
+    verse's text.
+
+    :param chapter: A (verses, translation title, permalink) tuple
+    :param verse: The verse to build the contents for
+    """
+
+    verses, trans_title, permalink = chapter
+
+    if verse.verse is None:
+        contents = "".join(text for number, text in verses)
+    else:
+        contents = "".join(text for number, text in verses
+                           if verse.start_verse <= number <= verse.end_verse)
+
+    if contents == "":
+        return None, None, None
+    return contents, trans_title, permalink
+
+
+def get_web_contents_futures(verses):
+    """ Starts retrieving the contents of several verses on the fetch
+    executor, and returns a future for each of them in the same order as
+    the input verses. Verses in memory are resolved straight away, since
+    that never blocks. Ranged BibleGateway verses that share a translation
+    are retrieved together with retrieve_contents_batch, in one request,
+    and resolve together; every other verse is retrieved on its
+    own, so it resolves as soon as its contents are in, however long the
+    others take. Each future resolves to a (contents, translation title,
+    permalink) tuple.
+
+    :param verses: The verses to grab the contents for
+    """
+
+    loop = asyncio.get_event_loop()
+    futures = [None] * len(verses)
+
+    groups = OrderedDict()
+    for i, verse in enumerate(verses):
+        result = get_memory_contents(verse)
+        if result is not None:
+            futures[i] = loop.create_future()
+            futures[i].set_result(result)
+        elif verse.translation != "JPS" and verse.verse is not None:
+            groups.setdefault(verse.translation, list()).append(i)
+        else:
+            groups[i] = [i]
+
+    for indexes in groups.values():
+        for j in range(0, len(indexes), MAX_BATCH_REFERENCES):
+            batch = indexes[j:j + MAX_BATCH_REFERENCES]
+            batch_future = loop.run_in_executor(
+                fetch_executor, retrieve_contents_batch,
+                [verses[i] for i in batch])
+            for k, i in enumerate(batch):
+                futures[i] = asyncio.ensure_future(
+                    batch_result(batch_future, k))
+
+    return futures
+
+
+async def batch_result(batch_future, index):
+    """ Returns one result of a batch once the whole batch is retrieved.
+
+    :param batch_future: Future of a list of results
+    :param index: The position of the result in the list
+    """
+
+    return (await batch_future)[index]
+
+
+def fetch_page(url, translation="", params=None):
+    """ Fetches a page through the shared HTTP client, recording the time
+    taken and any failure by host and translation.
+
+    :param url: The URL to fetch
+    :param translation: The translation the page belongs to, if any
+    :param params: Optional dictionary of query parameters
+    """
+
+    host = urlsplit(url).netloc
+    try:
+        with fetch_seconds.time(host=host, translation=translation):
+            return http_client.get(url, params=params)
+    except Exception:
+        fetch_errors_total.inc(host=host, translation=translation)
+        raise
+
+
 def find_supported_translations():
     """ Retrieves a list of supported translations from BibleGateway's
     translation page. """
 
-    url = "https://www.biblegateway.com/versions/"
+    url = BIBLE_GATEWAY_URL + "/versions/"
     translations = list()
 
-    page = urlopen(url)
-    soup = BeautifulSoup(page.read(), "html.parser")
-
-    t_has_ot = True
-    t_has_nt = True
-    t_has_deut = False
+    soup = BeautifulSoup(fetch_page(url), "html.parser")
 
     trans = soup.findAll("tr", {"class": "language-row"})
     for t in trans:
         if not t.find("a").has_attr("title"):
+            t_has_ot = True
+            t_has_nt = True
+            t_has_deut = False
             t_text = t.find("td", {"class": "translation-name"}).get_text()
             t_name = t_text[:t_text.rfind("(") - 1]
             t_abbreviation = t_text[t_text.rfind("(") + 1:t_text.rfind(")")]
@@ -92,105 +413,369 @@ def find_supported_translations():
 
 def get_bible_gateway_verse(verse):
     """ Retrieves the text for a user-supplied verse selection that
-    can be found on BibleGateway.
+    can be found on BibleGateway. Whole chapters go through the chapter
+    cache.
 
     :param verse: The verse to grab the contents for
     """
 
-    if verse.verse is not None:
-        url = ("https://www.biblegateway.com/passage/"
-               "?search=%s+%s:%s&version=%s"
-               % (verse.book.replace(" ", "%20"), verse.chapter,
-                  verse.verse, verse.translation))
-    else:
-        url = ("https://www.biblegateway.com/passage/?search=%s+%s&version=%s"
-               % (verse.book.replace(" ", "%20"), verse.chapter,
-                  verse.translation))
+    if verse.verse is None:
+        chapter = get_chapter(verse)
+        if chapter is None:
+            return None, None, None
+        return slice_chapter(chapter, verse)
 
-    page = urlopen(url)
-    soup = BeautifulSoup(page.read(), "html.parser")
+    url = (BIBLE_GATEWAY_URL + "/passage/?search=%s&version=%s"
+           % (bible_gateway_reference(verse), verse.translation))
 
-    verses = soup.findAll("span", {"class": "text"})
+    page = fetch_page(url, verse.translation)
 
-    if not verses:
+    with parse_seconds.time(translation=verse.translation):
+        soup = parse_bible_gateway_page(page)
+        contents = parse_bible_gateway_passage(soup, verse)
+
+    if contents is None:
         return None, None, None
 
     trans_title = soup.find("span",
                             {"class": "passage-display-version"}).get_text()
-    permalink = ("https://www.biblegateway.com/passage/"
-                 "?search=%s+%s&version=%s"
-                 % (verse.book, verse.chapter, verse.translation))
-
-    contents = ""
-    numbers = re.compile(r"(\d+)")
-    for v in verses:
-        if v.find("span", {"class": "indent-1-breaks"}) is not None:
-            v.find("span", {"class": "indent-1-breaks"}).decompose()
+
+    return contents, trans_title, bible_gateway_permalink(verse)
+
+
+def get_bible_gateway_chapter(verse):
+    """ Retrieves and parses the whole BibleGateway chapter a verse belongs
+    to. Returns a (verses, translation title, permalink) tuple, where verses
+    is a tuple of (verse number, text) pairs, or None if the chapter can't
+    be found.
+
+    :param verse: The verse to grab the chapter for
+    """
+
+    url = (BIBLE_GATEWAY_URL + "/passage/?search=%s+%s&version=%s"
+           % (verse.book.replace(" ", "%20"), verse.chapter,
+              verse.translation))
+
+    page = fetch_page(url, verse.translation)
+
+    with parse_seconds.time(translation=verse.translation):
+        soup = parse_bible_gateway_page(page)
+        verses = parse_bible_gateway_verses(soup, verse)
+
+    if not verses:
+        return None
+
+    trans_title = soup.find("span",
+                            {"class": "passage-display-version"}).get_text()
+
+    return tuple(verses), trans_title, bible_gateway_permalink(verse)
+
+
+def get_bible_gateway_verses(verses):
+    """ Retrieves the text for several verse selections of the same
+    translation with a single BibleGateway request. BibleGateway accepts
+    semicolon-separated references and renders one passage block per
+    reference, in order, which is split back into per-verse contents.
+    Returns a list of (contents, translation title, permalink) tuples in the
+    same order as the input verses.
+
+    :param verses: The verses to grab the contents for
+    """
+
+    url = (BIBLE_GATEWAY_URL + "/passage/?search=%s&version=%s"
+           % ("%3B".join(bible_gateway_reference(v) for v in verses),
+              verses[0].translation))
+
+    page = fetch_page(url, verses[0].translation)
+
+    with parse_seconds.time(translation=verses[0].translation):
+        soup = parse_bible_gateway_page(page)
+        passages = soup.findAll("div", {"class": "passage-text"})
+        title = soup.find("span", {"class": "passage-display-version"})
+
+        results = None
+        if len(passages) == len(verses) and title is not None:
+            trans_title = title.get_text()
+            results = list()
+            for passage, verse in zip(passages, verses):
+                contents = parse_bible_gateway_passage(passage, verse)
+                if contents is None:
+                    results.append((None, None, None))
+                else:
+                    results.append((contents, trans_title,
+                                    bible_gateway_permalink(verse)))
+
+    if results is None:
+        # BibleGateway silently drops references it can't find, so the
+        # passages can no longer be matched up with the verses.
+        return [get_bible_gateway_verse(v) for v in verses]
+
+    return results
+
+
+def bible_gateway_reference(verse):
+    """ Returns the URL-encoded BibleGateway search reference for a verse.
+
+    :param verse: The verse to build the reference for
+    """
+
+    if verse.verse is not None:
+        return "%s+%s:%s" % (verse.book.replace(" ", "%20"), verse.chapter,
+                             verse.verse)
+    else:
+        return "%s+%s" % (verse.book.replace(" ", "%20"), verse.chapter)
+
+
+def bible_gateway_permalink(verse):
+    """ Returns the link to the full chapter of a verse on BibleGateway.
+
+    :param verse: The verse to build the permalink for
+    """
+
+    return ("https://www.biblegateway.com/passage/?search=%s+%s&version=%s"
+            % (verse.book, verse.chapter, verse.translation))
+
+
+def parse_bible_gateway_passage(passage, verse):
+    """ Converts the text spans of a parsed BibleGateway passage into
+    message contents. Returns None if the passage contains no text.
+
+    :param passage: The parsed page, or the part of it holding the passage
+    :param verse: The verse the passage belongs to
+    """
+
+    verses = parse_bible_gateway_verses(passage, verse)
+
+    if not verses:
+        return None
+
+    return "".join(text for number, text in verses)
+
+
+def parse_bible_gateway_verses(passage, verse):
+    """ Converts the text spans of a parsed BibleGateway passage into a list
+    of (verse number, text) pairs, in page order. Headings are attached to
+    the verse they introduce.
+
+    :param passage: The parsed page, or the part of it holding the passage
+    :param verse: The verse the passage belongs to
+    """
+
+    numbers = list()
+    texts = list()
+    number = verse.start_verse
+    for v in passage.findAll("span", {"class": "text"}):
+        span_number = SPAN_NUMBER_REGEX.search(v["class"][-1])
+        if span_number is not None:
+            number = int(span_number.group(1))
+
+        breaks = find_span(v, is_indent_break)
+        if breaks is not None:
+            breaks.decompose()
+        text = v.get_text()
         if v.parent.name != "h3" and v.parent.name != "h4":
-            if "<span class=\"chapternum\">" in str(v):
-                text = v.get_text().replace(str(verse.chapter), "1") + " "
-            elif v.get_text().replace(" ", "") == "Back":
+            if find_span(v, is_chapter_number) is not None:
+                text = text.replace(str(verse.chapter), "1") + " "
+            elif text.replace(" ", "") == "Back":
                 text = ""
             else:
-                text = v.get_text() + " "
-            text = numbers.sub(r"[**\1**]", text, 1)
+                text += " "
+            text = VERSE_NUMBER_REGEX.sub(r"[**\1**]", text, 1)
         else:
-            text = "\n\n>**" + v.get_text() + "**  \n"
+            text = "\n\n>**" + text + "**  \n"
 
-        contents += re.sub(r"\[\w\]", "", text)
+        text = FOOTNOTE_REGEX.sub("", text)
+        if numbers and numbers[-1] == number:
+            texts[-1].append(text)
+        else:
+            numbers.append(number)
+            texts.append([text])
 
-    return contents, trans_title, permalink
+    return [(n, "".join(t)) for n, t in zip(numbers, texts)]
+
+
+def find_span(tag, match):
+    """ Returns the first span below a tag for which match returns true, or
+    None. Cheaper than Tag.find for the few spans inside a verse.
+
+    :param tag: The tag to search
+    :param match: Function called with each span
+    """
+
+    for child in tag.descendants:
+        if isinstance(child, Tag) and child.name == "span" and match(child):
+            return child
+    return None
+
+
+def is_indent_break(span):
+    """ Returns true if a span is the indentation BibleGateway puts in front
+    of an indented line of poetry.
+
+    :param span: The span to check
+    """
+
+    return "indent-1-breaks" in span.get("class", ())
+
+
+def is_chapter_number(span):
+    """ Returns true if a span is the chapter number BibleGateway puts in
+    front of the first verse of a chapter.
+
+    :param span: The span to check
+    """
+
+    return span.attrs == {"class": ["chapternum"]}
+
+
+def parse_bible_gateway_page(page):
+    """ Parses the passage blocks and translation title of a BibleGateway
+    passage page, skipping the rest of the page.
+
+    :param page: The page, as bytes or a string
+    """
+
+    return BeautifulSoup(page, HTML_PARSER,
+                         parse_only=BIBLE_GATEWAY_STRAINER)
 
 
 def get_bible_hub_verse(verse):
     """ Retrieves the text for a user-supplied verse selection that can be
-    found on Bible Hub.
+    found on Bible Hub. The chapter is fetched once and then sliced for
+    every later verse selection in it.
     :param verse: The verse to grab the contents for"""
 
-    url = ("http://biblehub.com/%s/%s/%d.htm"
-           % (verse.translation.lower(), verse.book.lower().replace(" ", "_"),
-              verse.chapter))
+    chapter = get_chapter(verse)
 
-    page = urlopen(url)
-    soup = BeautifulSoup(page.read(), "html.parser")
+    if chapter is None:
+        return None, None, None
 
-    verses = soup.find("div", {"class": "chap"})
+    return slice_chapter(chapter, verse)
 
-    if len(verses) < 1:
-        return None, None, None
 
-    for cur_verse in verses.findAll("b"):
-        cur_verse.decompose()
-    text = verses.get_text()
+def get_bible_hub_chapter(verse):
+    """ Retrieves and parses the whole Bible Hub chapter a verse belongs to.
+    Returns a (verses, translation title, permalink) tuple, where verses is
+    a tuple of (verse number, text) pairs, or None if the chapter can't be
+    found.
+
+    :param verse: The verse to grab the chapter for
+    """
+
+    url = bible_hub_url(verse)
+    page = fetch_page(url, verse.translation)
+
+    with parse_seconds.time(translation=verse.translation):
+        soup = BeautifulSoup(page, HTML_PARSER, parse_only=BIBLE_HUB_STRAINER)
+        verses = soup.find("div", {"class": "chap"})
+
+        if verses is None or len(verses) < 1:
+            return None
+
+        for cur_verse in verses.findAll("b"):
+            cur_verse.decompose()
+        text = verses.get_text()
 
     trans_title = soup.find("div", {"class": "vheading"}).get_text()
 
-    verse_list = text.splitlines()
+    verse_list = tuple((i + 1, "[**%d**] %s " % (i + 1, val))
+                       for i, val in enumerate(text.splitlines()))
+
+    return verse_list, trans_title, url
 
-    contents = ""
-    for i, val in enumerate(verse_list):
-        verse_num = i + 1
-        if verse.start_verse == 0:
-            contents += ("[**%d**] %s " % (verse_num, val))
-        else:
-            if (verse_num >= verse.start_verse and
-                    (verse.end_verse == 0 or verse_num <= verse.end_verse)):
-                contents += ("[**%d**] %s " % (verse_num, val))
 
-    return contents, trans_title, url
+def bible_hub_url(verse):
+    """ Returns the URL of the Bible Hub chapter of a verse.
+
+    :param verse: The verse to build the URL for
+    """
+
+    return (BIBLE_HUB_URL + "/%s/%s/%d.htm"
+            % (verse.translation.lower(),
+               verse.book.lower().replace(" ", "_"), verse.chapter))
 
 
 def search_bible_gateway(search_terms, version='ESV'):
-    url = 'https://www.biblegateway.com/quicksearch/'
+    """ Returns the reference of the verse that best matches quoted text, or
+    None. The local quote index of the translation is searched first;
+    BibleGateway is only searched when the index has no match, and
+    concurrent searches for the same text share one request.
+
+    :param search_terms: The quoted text to search for
+    :param version: The translation to search in
+    """
+
+    reference = quote_index.search(search_terms, version)
+    if reference is not None:
+        quote_searches_total.inc(source="local")
+        return reference
+
+    quote_searches_total.inc(source="remote")
+    return flights.do(("search", search_terms, version),
+                      fetch_search_reference, search_terms, version)
+
+
+def fetch_search_reference(search_terms, version='ESV'):
+    """ Searches BibleGateway for quoted text and returns the reference of
+    the best match, or None. The verses of every result are added to the
+    quote index.
+
+    :param search_terms: The quoted text to search for
+    :param version: The translation to search in
+    """
+
+    url = BIBLE_GATEWAY_URL + '/quicksearch/'
     params = {'quicksearch': search_terms.replace(' ', '+'), 'version': version}
 
-    r = requests.get(url, params=params)
-    soup = BeautifulSoup(r.text, 'html.parser')
+    soup = BeautifulSoup(fetch_page(url, version, params), HTML_PARSER,
+                         parse_only=QUICKSEARCH_STRAINER)
     search_results = soup.find_all('article', class_='row bible-item')
 
     if len(search_results) == 0:
         return None
 
+    for result in search_results:
+        index_search_result(result, version)
+
     reference = search_results[0].div.a.string
 
     return str(reference)
+
+
+def index_search_result(result, version):
+    """ Adds the verse of a BibleGateway search result to the quote index.
+    Results spanning several verses are skipped, since their text can't be
+    split into verses.
+
+    :param result: The parsed article of the result
+    :param version: The translation that was searched
+    """
+
+    title = result.find('a', class_='bible-item-title')
+    text = result.find('div', class_='bible-item-text')
+    if title is None or text is None or title.string is None:
+        return
+
+    references = find_references('[' + title.string + ']')
+    if not references:
+        return
+
+    reference = references[0]
+    if reference.verse is None or reference.start_verse != reference.end_verse:
+        return
+
+    quote_index.add(version, reference.book.name, reference.chapter,
+                    [(reference.start_verse, text.get_text())])
+
+
+def search_bible_gateway_async(search_terms, version='ESV'):
+    """ Runs search_bible_gateway on the fetch executor. Returns an awaitable
+    that resolves to the matching reference, or None.
+
+    :param search_terms: The quoted text to search for
+    :param version: The translation to search in
+    """
+
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(fetch_executor, search_bible_gateway,
+                                search_terms, version)
@@ -0,0 +1,141 @@
+"""
+VerseBot for Slack
+By Matt Arnold
+workqueue.py
+Copyright (c) 2016 Matt Arnold (MIT License)
+"""
+
+import asyncio
+import logging
+import time
+
+import metrics
+
+# Number of worker tasks handling queued messages for each workspace
+WORKERS = 4
+
+# Number of messages that may wait in the queue of each workspace
+QUEUE_SIZE = 100
+
+# What happens to a message that arrives while the queue is full
+BLOCK = "block"              # wait for room, pausing the receive loop
+DROP_NEWEST = "drop_newest"  # discard the incoming message
+DROP_OLDEST = "drop_oldest"  # discard the message that has waited longest
+
+OVERFLOW_POLICY = DROP_OLDEST
+
+
+class WorkQueue:
+    """ Bounded queue of messages drained by a pool of worker tasks. put()
+    never waits unless the overflow policy is BLOCK, so the receive loop
+    keeps reading the websocket while slow responses are handled. """
+
+    def __init__(self, handler, workers=WORKERS, maxsize=QUEUE_SIZE,
+                 overflow=OVERFLOW_POLICY, workspace="unknown"):
+        """ Initializes an empty WorkQueue. Workers are started by start().
+
+        :param handler: Coroutine function called with every queued item
+        :param workspace: The workspace label of the queue's metrics
+        """
+
+        self.handler = handler
+        self.workspace = workspace
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.log = logging.getLogger("versebot")
+        self._queue = asyncio.Queue(maxsize)
+        self._tasks = list()
+
+        self.max_depth = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def start(self):
+        """ Starts the worker tasks if they aren't running. """
+
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._work())
+                           for i in range(self.workers)]
+
+    def stop(self):
+        """ Cancels the worker tasks. Queued items are kept. """
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = list()
+
+    async def put(self, item):
+        """ Queues an item for the workers, applying the overflow policy if
+        the queue is full. Returns false if the item was dropped.
+
+        :param item: The item to pass to the handler
+        """
+
+        entry = (time.monotonic(), item)
+
+        if self.overflow == BLOCK:
+            await self._queue.put(entry)
+        else:
+            if self._queue.full():
+                self._drop()
+                if self.overflow == DROP_NEWEST:
+                    return False
+                self._queue.get_nowait()
+            self._queue.put_nowait(entry)
+
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        self._export_depth()
+        return True
+
+    def depth(self):
+        """ Returns the number of items waiting in the queue. """
+
+        return self._queue.qsize()
+
+    def stats(self):
+        """ Returns a dictionary of the queue's metrics. """
+
+        waits = self.waits or 1
+        return {"depth": self._queue.qsize(), "max_depth": self.max_depth,
+                "enqueued": self.enqueued, "dropped": self.dropped,
+                "processed": self.processed,
+                "mean_wait": self.wait_total / waits,
+                "max_wait": self.wait_max}
+
+    def _drop(self):
+        self.dropped += 1
+        metrics.queue_dropped_total.inc(workspace=self.workspace)
+        self.log.warning("work queue of %s is full (%d messages), %s "
+                         "message dropped (%d so far)" % (
+                             self.workspace, self.maxsize,
+                             "incoming" if self.overflow == DROP_NEWEST
+                             else "oldest", self.dropped))
+
+    def _export_depth(self):
+        metrics.queue_depth.set(self._queue.qsize(), workspace=self.workspace)
+
+    async def _work(self):
+        while True:
+            queued, item = await self._queue.get()
+            self._export_depth()
+
+            wait = time.monotonic() - queued
+            self.waits += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            metrics.queue_wait_seconds.observe(wait, workspace=self.workspace)
+
+            try:
+                await self.handler(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log.error('caught ' + str(type(e)) + ':' + str(e))
+            finally:
+                self.processed += 1